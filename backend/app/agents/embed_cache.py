@@ -0,0 +1,134 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+
+_SPACES = re.compile(r"\s+")
+
+
+def text_key(text: str) -> str:
+    # NFKC + collapsed whitespace, so PDF re-extractions that only differ in spacing still hit
+    norm = _SPACES.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+    return hashlib.sha1(norm.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Persistent float32 embedding store keyed by (model id, normalised text hash).
+
+    Lives in its own SQLite file so cache traffic never contends with the app
+    database. Rows are evicted least-recently-used once the stored vectors
+    exceed max_bytes.
+    """
+
+    _IN_BATCH = 500
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embedding ("
+            " model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL, PRIMARY KEY (model, text_hash)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_embedding_last_used ON embedding (last_used)")
+        self._conn.commit()
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embedding").fetchone()[0]
+
+    def get_many(self, model: str, keys: Sequence[str], dimensions: int) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            for i in range(0, len(unique), self._IN_BATCH):
+                part = unique[i:i + self._IN_BATCH]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embedding WHERE model = ? AND text_hash IN ({marks})",
+                    [model, *part],
+                ).fetchall()
+                for key, blob in rows:
+                    vec = np.frombuffer(blob, dtype=np.float32)
+                    if vec.shape[0] == dimensions:
+                        found[key] = vec
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embedding SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, k) for k in found],
+                )
+                self._conn.commit()
+            self.hits += sum(1 for k in keys if k in found)
+            self.misses += sum(1 for k in keys if k not in found)
+        return found
+
+    def put_many(self, model: str, keys: Sequence[str], vectors: np.ndarray) -> None:
+        if not len(keys):
+            return
+        now = time.time()
+        rows = [(model, k, np.ascontiguousarray(v, dtype=np.float32).tobytes(), now) for k, v in zip(keys, vectors)]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embedding (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            self._bytes += sum(len(r[2]) for r in rows)
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        # Trim to 90% of the budget so eviction does not run on every insert
+        target = int(self.max_bytes * 0.9)
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embedding").fetchone()[0]
+        while self._bytes > target:
+            rows = self._conn.execute(
+                "SELECT model, text_hash, LENGTH(vector) FROM embedding ORDER BY last_used LIMIT 1000"
+            ).fetchall()
+            if not rows:
+                break
+            freed = 0
+            doomed = []
+            for model, key, size in rows:
+                doomed.append((model, key))
+                freed += size
+                if self._bytes - freed <= target:
+                    break
+            self._conn.executemany("DELETE FROM embedding WHERE model = ? AND text_hash = ?", doomed)
+            self._bytes -= freed
+        self._conn.commit()
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def split_cached(cache: EmbeddingCache, model: str, texts: Sequence[str], dimensions: int):
+    """Look texts up in the cache.
+
+    Returns (keys, cached vectors by key, indexes of texts that still need embedding).
+    """
+    keys = [text_key(t) for t in texts]
+    found = cache.get_many(model, keys, dimensions)
+    missing: List[int] = [i for i, k in enumerate(keys) if k not in found]
+    return keys, found, missing
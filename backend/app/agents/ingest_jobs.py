@@ -0,0 +1,138 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, Optional
+
+from ..core.config import INGEST_WORKERS, INGEST_JOB_HISTORY
+from ..core.metrics import Counter, Histogram, RATE_BUCKETS
+from ..utils.pdf import iter_pdf_pages, shutdown_pdf_pool
+from .registry import get_kb
+from .river_agent import ingest_uploads
+from .kb_index import maintain_kb_quietly
+
+
+@dataclass
+class IngestJob:
+    id: str
+    filename: str
+    status: str = "queued"  # queued, running, done, failed
+    pages_parsed: int = 0
+    chunks_embedded: int = 0
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = 0.0
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "pages_parsed": self.pages_parsed,
+            "chunks_embedded": self.chunks_embedded,
+            "error": self.error,
+            "elapsed_s": round(elapsed, 3),
+            "pages_per_s": round(self.pages_parsed / elapsed, 2) if elapsed > 0 else 0.0,
+            "chunks_per_s": round(self.chunks_embedded / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+
+
+_lock = threading.Lock()
+_jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+# One lock per filename: uploads replace the file and jobs ingest it under it, so a
+# job never reads a file that is being rewritten
+_file_locks: Dict[str, threading.Lock] = {}
+_executor: Optional[ThreadPoolExecutor] = None
+
+ingest_pages = Counter("riverai_ingest_pages_total", "PDF pages parsed by ingestion jobs.")
+ingest_chunks = Counter("riverai_ingest_chunks_total", "Chunks embedded and inserted by ingestion jobs.")
+ingest_jobs = Counter("riverai_ingest_jobs_total", "Finished ingestion jobs.", ("status",))
+ingest_job_seconds = Histogram("riverai_ingest_job_seconds", "Wall time of one ingestion job.")
+ingest_pages_per_second = Histogram("riverai_ingest_pages_per_second", "Pages per second of one ingestion job.", buckets=RATE_BUCKETS)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(INGEST_WORKERS, 1), thread_name_prefix="ingest")
+        return _executor
+
+
+def file_lock(filename: str) -> threading.Lock:
+    with _lock:
+        return _file_locks.setdefault(filename, threading.Lock())
+
+
+def _run(job: IngestJob) -> None:
+    job.status = "running"
+    job.started_at = time.time()
+
+    def parse(path: str) -> Iterator[Dict[str, Any]]:
+        # Pages are extracted in the shared PDF process pool
+        for page in iter_pdf_pages(path):
+            job.pages_parsed += 1
+            ingest_pages.inc()
+            yield page
+
+    def on_chunks(n: int) -> None:
+        job.chunks_embedded += n
+        ingest_chunks.inc(n)
+
+    try:
+        kb = get_kb()
+        with file_lock(job.filename):
+            result = ingest_uploads(kb, only=[job.filename], parse=parse, on_chunks=on_chunks)
+        if job.filename in result["failed"]:
+            job.status = "failed"
+            job.error = result["failed"][job.filename]
+        else:
+            if result["files"]:
+                # Compact the new fragments and keep the ANN index current
+                maintain_kb_quietly(kb)
+            job.status = "done"
+    except Exception as e:
+        print(f"Ingest job {job.id} failed: {e}")
+        job.status = "failed"
+        job.error = str(e)
+    finally:
+        job.finished_at = time.time()
+        elapsed = job.finished_at - job.started_at
+        ingest_jobs.inc(status=job.status)
+        ingest_job_seconds.observe(elapsed)
+        if job.pages_parsed and elapsed > 0:
+            ingest_pages_per_second.observe(job.pages_parsed / elapsed)
+
+
+def submit_ingest(filename: str) -> IngestJob:
+    job = IngestJob(id=uuid.uuid4().hex, filename=filename)
+    with _lock:
+        _jobs[job.id] = job
+        # Keep a bounded history of finished jobs
+        while len(_jobs) > max(INGEST_JOB_HISTORY, 1):
+            oldest = next(iter(_jobs.values()))
+            if oldest.status in ("queued", "running"):
+                break
+            _jobs.popitem(last=False)
+    _get_executor().submit(_run, job)
+    return job
+
+
+def get_job(job_id: str) -> Optional[IngestJob]:
+    with _lock:
+        return _jobs.get(job_id)
+
+
+def shutdown_ingest_workers() -> None:
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+    shutdown_pdf_pool()
@@ -0,0 +1,107 @@
+import math
+import threading
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+from agno.knowledge import Knowledge
+
+from ..core.config import (
+    EMBED_DIMENSIONS, KB_INDEX_MIN_ROWS, KB_INDEX_TYPE, KB_REINDEX_UNINDEXED_RATIO, KB_VERSION_RETENTION_MIN,
+)
+from .retrieval import ensure_kb_schema, ensure_fts_index
+
+
+# Index builds and compaction rewrite table files; never run two at once
+_maintenance_lock = threading.Lock()
+
+
+def _table(kb: Knowledge):
+    return getattr(kb.vector_db, "table", None)
+
+
+def _vector_index(table) -> Optional[Any]:
+    for idx in table.list_indices():
+        if "vector" in list(getattr(idx, "columns", []) or []):
+            return idx
+    return None
+
+
+def index_status(kb: Knowledge) -> Dict[str, Any]:
+    table = _table(kb)
+    if table is None:
+        return {"exists": False}
+    rows = table.count_rows()
+    status: Dict[str, Any] = {
+        "exists": True,
+        "rows": rows,
+        "version": table.version,
+        "index_min_rows": KB_INDEX_MIN_ROWS,
+        "vector_index": None,
+    }
+    idx = _vector_index(table)
+    if idx is not None:
+        stats = table.index_stats(idx.name)
+        status["vector_index"] = {
+            "name": idx.name,
+            "type": str(getattr(idx, "index_type", "")),
+            "indexed_rows": getattr(stats, "num_indexed_rows", None),
+            "unindexed_rows": getattr(stats, "num_unindexed_rows", None),
+        }
+    return status
+
+
+def _build_vector_index(table, rows: int) -> None:
+    # ~sqrt(n) partitions; PQ sub-vectors must divide the dimension (512 / 16 = 32)
+    num_partitions = max(1, min(int(math.sqrt(rows)), 4096))
+    kwargs: Dict[str, Any] = {
+        "metric": "cosine",
+        "vector_column_name": "vector",
+        "index_type": KB_INDEX_TYPE,
+        "num_partitions": num_partitions,
+        "replace": True,
+    }
+    if "PQ" in KB_INDEX_TYPE:
+        kwargs["num_sub_vectors"] = max(1, EMBED_DIMENSIONS // 16)
+    print(f"Building {KB_INDEX_TYPE} index on riverai_kb ({rows} rows, {num_partitions} partitions)")
+    table.create_index(**kwargs)
+
+
+def maintain_kb(kb: Knowledge, reindex: bool = False) -> Dict[str, Any]:
+    """Build the ANN index once the table is big enough, then compact fragments,
+    fold new rows into the index and prune old versions."""
+    table = _table(kb)
+    if table is None:
+        return {"exists": False}
+    actions = []
+    with _maintenance_lock:
+        ensure_kb_schema(kb.vector_db)
+        # The schema rebuild may have replaced the table
+        table = _table(kb)
+        ensure_fts_index(table)
+        rows = table.count_rows()
+        idx = _vector_index(table)
+        if rows >= KB_INDEX_MIN_ROWS:
+            rebuild = reindex or idx is None
+            if idx is not None and not rebuild:
+                # optimize() appends new rows to the existing partitions; retrain
+                # from scratch once too much of the table sits outside them.
+                stats = table.index_stats(idx.name)
+                unindexed = getattr(stats, "num_unindexed_rows", 0) or 0
+                rebuild = unindexed > rows * KB_REINDEX_UNINDEXED_RATIO
+            if rebuild:
+                _build_vector_index(table, rows)
+                actions.append("index")
+
+        table.optimize(cleanup_older_than=timedelta(minutes=KB_VERSION_RETENTION_MIN))
+        actions.append("optimize")
+    status = index_status(kb)
+    status["actions"] = actions
+    return status
+
+
+def maintain_kb_quietly(kb: Knowledge, reindex: bool = False) -> None:
+    # For background callers (ingest jobs, startup): maintenance failures must not fail them
+    try:
+        maintain_kb(kb, reindex=reindex)
+    except Exception as e:
+        print(f"KB maintenance failed: {e}")
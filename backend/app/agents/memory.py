@@ -1,8 +1,14 @@
 import json
-from typing import Any, Dict
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from sqlmodel import select
+from ..core.config import HISTORY_MAX_TURNS, HISTORY_TOKEN_BUDGET
 from ..core.db import get_session
-from ..db.models import SessionState
+from ..db.models import Message, SessionState
+from ..db.writer import messages_before, messages_after
+from ..utils.chunking import count_tokens
 
 
 class SQLiteSessionMemory:
@@ -33,5 +39,112 @@ class SQLiteSessionMemory:
                 s.add(row)
             else:
                 row.state_json = payload
+                row.updated_at = datetime.utcnow()
             s.commit()
 
+
+# summarize(previous_summary, [{"role", "content"}, ...]) -> new summary
+Summarizer = Callable[[str, List[Dict[str, str]]], str]
+
+
+class ConversationHistory:
+    """Bounded prompt history for a Conversation.
+
+    The newest turns are sent verbatim (at most max_turns user/assistant pairs
+    within token_budget); everything older is folded into a rolling summary
+    kept in SessionState as {"summary", "summarized_upto": <Message.id>}.
+    Folding calls the LLM, so it runs in the background after a reply rather
+    than on the request path. Until the summary covers them, turns that left
+    the window are still sent verbatim, so nothing drops out of the prompt when
+    a fold is late or fails.
+    """
+
+    def __init__(
+        self,
+        memory: Optional[SQLiteSessionMemory] = None,
+        max_turns: int = HISTORY_MAX_TURNS,
+        token_budget: int = HISTORY_TOKEN_BUDGET,
+    ):
+        self.memory = memory or SQLiteSessionMemory(namespace="history")
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-fold")
+        self._pending: set = set()
+        self._lock = threading.Lock()
+
+    def _window(self, conversation_id: int, before_id: int) -> Tuple[Dict[str, Any], List[Dict[str, str]], List[Tuple[int, Dict[str, str]]]]:
+        """Return (state, recent turns, older unsummarised (id, turn) pairs)."""
+        state = self.memory.load(str(conversation_id))
+        upto = state.get("summarized_upto", 0)
+        with get_session() as s:
+            # (created_at, id) order: write-behind replies can get a higher id than a later message
+            q = select(Message.id, Message.role, Message.content).where(
+                Message.conversation_id == conversation_id, messages_before(s, before_id)
+            )
+            if upto:
+                q = q.where(messages_after(s, upto))
+            rows = s.exec(q.order_by(Message.created_at, Message.id)).all()
+
+        recent: List[Dict[str, str]] = []
+        used = 0
+        users = 0
+        cut = len(rows)
+        for i in range(len(rows) - 1, -1, -1):
+            _, role, content = rows[i]
+            cost = count_tokens(content)
+            if role == "user":
+                users += 1
+            if users > self.max_turns or used + cost > self.token_budget:
+                break
+            used += cost
+            recent.append({"role": role, "content": content})
+            cut = i
+        recent.reverse()
+        older = [(mid, {"role": role, "content": content}) for mid, role, content in rows[:cut]]
+        return state, recent, older
+
+    def context(self, conversation_id: int, before_id: int) -> Optional[Dict[str, Any]]:
+        """Summary + turns after summarized_upto preceding message `before_id`, or None
+        for a fresh conversation."""
+        state, recent, older = self._window(conversation_id, before_id)
+        ctx: Dict[str, Any] = {}
+        if state.get("summary"):
+            ctx["conversation_summary"] = state["summary"]
+        # Older turns not folded yet stay in; the fold after this reply covers them
+        turns = [turn for _, turn in older] + recent
+        if turns:
+            ctx["recent_turns"] = turns
+        return ctx or None
+
+    def fold(self, conversation_id: int, before_id: int, summarize: Summarizer) -> bool:
+        """Fold turns that fell out of the window into the summary. Returns True if it changed."""
+        state, _, older = self._window(conversation_id, before_id)
+        if not older:
+            return False
+        summary = summarize(state.get("summary", ""), [turn for _, turn in older])
+        self.memory.save(str(conversation_id), {"summary": summary, "summarized_upto": older[-1][0]})
+        return True
+
+    def schedule_fold(self, conversation_id: int, before_id: int, summarize: Summarizer) -> None:
+        with self._lock:
+            if conversation_id in self._pending:
+                return
+            self._pending.add(conversation_id)
+
+        def job():
+            try:
+                self.fold(conversation_id, before_id, summarize)
+            except Exception as e:
+                # Nothing is lost: the turns stay unsummarised and the next fold retries them
+                print(f"History fold for conversation {conversation_id} failed: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(conversation_id)
+
+        self._executor.submit(job)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+history = ConversationHistory()
@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..core.config import PREFETCH_ENABLED, PREFETCH_RESULTS, PREFETCH_TTL, PREFETCH_WAIT
+from ..core.metrics import Counter
+
+
+# /chat/send starts KB retrieval for the new message here; /chat/stream picks it
+# up, so embedding + LanceDB search overlap with the client's round trip.
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+_lock = threading.Lock()
+# conversation_id -> (message_id, started_at, future)
+_slots: Dict[int, Tuple[int, float, Future]] = {}
+prefetch_results = Counter("riverai_prefetch_total", "Prefetched retrievals taken by /chat/stream.", ("result",))
+
+
+def _purge(now: float) -> None:
+    for cid in [cid for cid, (_, started, _) in _slots.items() if now - started > PREFETCH_TTL]:
+        del _slots[cid]
+
+
+def _retrieve(query: str) -> Optional[List[Any]]:
+    from .registry import get_kb
+
+    # get_kb may load the embedding model on first use; that happens here, not in /chat/send
+    kb = get_kb()
+    if getattr(kb.vector_db, "table", None) is None:
+        return None
+    # Search with the count agno's search tool asks for (kb.max_results), so the entry
+    # this puts in the retrieval cache has the tool's key: if the prefetch lands too late
+    # for /chat/stream and the model searches the same query, that call is a hit.
+    # Hybrid search ranks the same candidates for either count, so the first
+    # PREFETCH_RESULTS are the same documents
+    docs = kb.search(query, max_results=kb.max_results)
+    return docs[:PREFETCH_RESULTS]
+
+
+def start_prefetch(conversation_id: int, message_id: int, query: str) -> None:
+    if not PREFETCH_ENABLED or not query.strip():
+        return
+    fut = _executor.submit(_retrieve, query)
+    now = time.monotonic()
+    with _lock:
+        _purge(now)
+        _slots[conversation_id] = (message_id, now, fut)
+
+
+async def take_prefetch(conversation_id: int, message_id: int) -> Optional[List[Any]]:
+    """Pop the prefetched documents for this message, waiting up to PREFETCH_WAIT for them."""
+    with _lock:
+        _purge(time.monotonic())
+        slot = _slots.pop(conversation_id, None)
+    if slot is None or slot[0] != message_id:
+        prefetch_results.inc(result="missing")
+        return None
+    result = "ready" if slot[2].done() else "waited"
+    try:
+        docs = await asyncio.wait_for(asyncio.wrap_future(slot[2]), PREFETCH_WAIT)
+    except Exception as e:
+        print(f"Prefetch for conversation {conversation_id} not used: {e!r}")
+        prefetch_results.inc(result="failed")
+        return None
+    prefetch_results.inc(result=result)
+    return docs
+
+
+def docs_to_context(docs: List[Any]) -> List[Dict[str, Any]]:
+    out = []
+    for d in docs:
+        meta = d.meta_data or {}
+        score = meta.get("score")
+        if score is None:
+            score = getattr(d, "reranking_score", None)
+        out.append({"file_name": meta.get("file_name"), "page": meta.get("page"), "score": score, "content": d.content})
+    return out
+
+
+def shutdown_prefetch() -> None:
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,124 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import lancedb
+from agno.agent import Agent
+from agno.knowledge import Knowledge
+
+from ..core.config import LANCEDB_DIR, DEEPSEEK_API_KEY, DEEPSEEK_BASE_URL, AGENT_CACHE_SIZE
+from ..core.metrics import Callback, Counter, stage
+from .river_agent import LocalFastEmbedEmbedder, build_embedder, build_kb, build_agent
+
+
+# Process-wide singletons. The embedder holds the ONNX model and the
+# connection holds the LanceDB handle, so both are created once and shared
+# by every request (chat, upload, ingestion).
+_lock = threading.Lock()
+_embedder: Optional[LocalFastEmbedEmbedder] = None
+_connection = None
+_kb: Optional[Knowledge] = None
+
+AgentKey = Tuple[Optional[str], str, str, bool]
+_agents: "OrderedDict[AgentKey, Agent]" = OrderedDict()
+
+agent_lookups = Counter("riverai_agent_cache_total", "Agent cache lookups.", ("result",))
+
+
+def _embed_cache_stats():
+    cache = getattr(_embedder, "cache", None)
+    if cache is None:
+        return []
+    return [(("hit",), cache.hits), (("miss",), cache.misses)]
+
+
+Callback("riverai_embed_cache_total", "Persistent embedding cache lookups.", ("result",), _embed_cache_stats, kind="counter")
+
+
+def get_embedder() -> LocalFastEmbedEmbedder:
+    global _embedder
+    if _embedder is None:
+        with _lock:
+            if _embedder is None:
+                with stage("embedder_load"):
+                    _embedder = build_embedder()
+    return _embedder
+
+
+def get_connection():
+    global _connection
+    if _connection is None:
+        with _lock:
+            if _connection is None:
+                _connection = lancedb.connect(os.path.abspath(LANCEDB_DIR.as_posix()))
+    return _connection
+
+
+def get_kb() -> Knowledge:
+    global _kb
+    if _kb is None:
+        embedder = get_embedder()
+        connection = get_connection()
+        with _lock:
+            if _kb is None:
+                with stage("kb_load"):
+                    _kb = build_kb(embedder=embedder, connection=connection)
+    return _kb
+
+
+def _hash_key(api_key: Optional[str]) -> str:
+    # Never keep raw credentials in the cache key
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+
+
+def _agent_key(api_base_url: Optional[str], api_key: Optional[str], mode: str, search_knowledge: bool = True) -> AgentKey:
+    # Resolve env fallbacks the same way build_agent does, so a user without
+    # custom credentials shares the default agent.
+    base_url = api_base_url or DEEPSEEK_BASE_URL
+    key = api_key or DEEPSEEK_API_KEY
+    return (base_url, _hash_key(key), mode, search_knowledge)
+
+
+def get_agent(api_base_url: Optional[str], api_key: Optional[str], mode: str = "chat", search_knowledge: bool = True) -> Agent:
+    """Cached agent for these credentials and mode. search_knowledge=False gives
+    the variant without the KB search tool, for runs that get prefetched passages."""
+    k = _agent_key(api_base_url, api_key, mode, search_knowledge)
+    with _lock:
+        agent = _agents.get(k)
+        if agent is not None:
+            _agents.move_to_end(k)
+            agent_lookups.inc(result="hit")
+            return agent
+
+    agent_lookups.inc(result="miss")
+    kb = get_kb()
+    with stage("agent_build"):
+        agent = build_agent(api_base_url, api_key, mode=mode, kb=kb, search_knowledge=search_knowledge)
+
+    with _lock:
+        # Another request may have built the same agent meanwhile; keep the first one.
+        existing = _agents.get(k)
+        if existing is not None:
+            _agents.move_to_end(k)
+            return existing
+        _agents[k] = agent
+        while len(_agents) > max(AGENT_CACHE_SIZE, 1):
+            _agents.popitem(last=False)
+    return agent
+
+
+def invalidate_agents(api_base_url: Optional[str], api_key: Optional[str]) -> int:
+    """Drop cached agents built for these credentials (all modes and variants)."""
+    base_url, key_hash, _, _ = _agent_key(api_base_url, api_key, "")
+    with _lock:
+        stale = [k for k in _agents if k[0] == base_url and k[1] == key_hash]
+        for k in stale:
+            del _agents[k]
+    return len(stale)
+
+
+def clear_agents() -> None:
+    with _lock:
+        _agents.clear()
@@ -0,0 +1,269 @@
+import asyncio
+import json
+import threading
+from hashlib import md5
+from typing import Any, Dict, List, Optional
+
+import pyarrow as pa
+from agno.knowledge.document import Document
+
+from ..core.config import HYBRID_CANDIDATES, HYBRID_RRF_K, KB_NPROBES
+from ..core.metrics import stage
+from .retrieval_cache import CachedKnowledge
+
+
+# Plain columns next to agno's (vector, id, payload): FTS runs over `text`, scoped
+# queries pre-filter on file_name/page instead of parsing payload JSON, and
+# file_hash lets a document's chunks be deleted without matching payload text.
+EXTRA_COLUMNS = {
+    "file_name": pa.string(),
+    "page": pa.int32(),
+    "text": pa.string(),
+    "file_hash": pa.string(),
+}
+FILTER_KEYS = {"file_name", "page"}
+# Stored in the table's schema metadata once ensure_kb_schema has rebuilt it
+SCHEMA_KEY = b"riverai_kb_schema"
+SCHEMA_VERSION = b"2"
+
+_schema_lock = threading.Lock()
+_schema_ready: Dict[int, bool] = {}
+_fts_ready: Dict[int, bool] = {}
+
+
+def schema_ready(table) -> bool:
+    if table is None:
+        return False
+    if not _schema_ready.get(id(table)):
+        _schema_ready[id(table)] = (table.schema.metadata or {}).get(SCHEMA_KEY) == SCHEMA_VERSION
+    return _schema_ready[id(table)]
+
+
+def _extras_from_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    meta = payload.get("meta_data") or {}
+    page = meta.get("page")
+    return {
+        "file_name": meta.get("file_name"),
+        "page": int(page) if isinstance(page, (int, float)) else None,
+        "text": payload.get("content"),
+        "file_hash": meta.get("file_hash"),
+    }
+
+
+def row_id(file_hash: Optional[str], page: Any, chunk: Any) -> str:
+    # One row per chunk of a file's content: identical text in two files stays two rows
+    return md5(f"{file_hash}:{page}:{chunk}".encode()).hexdigest()
+
+
+def rebuild_kb_table(vector_db) -> int:
+    """Rewrite riverai_kb in one pass with EXTRA_COLUMNS filled and unique ids.
+
+    Rows with a repeated id (documents ingested twice) are dropped; the rest are
+    re-keyed by (file hash, page, chunk), falling back to the row's position within
+    its page for rows written before chunk indexes were recorded. The new table
+    replaces the old one as a single overwrite commit and carries SCHEMA_VERSION in
+    its schema metadata, so an interrupted rebuild is simply redone.
+    Returns the number of rows kept.
+    """
+    table = vector_db.table
+    data = table.to_arrow()
+    keep: List[int] = []
+    seen, new_ids = set(), set()
+    ids, extras = [], []
+    ordinals: Dict[tuple, int] = {}
+    for i, (old_id, raw) in enumerate(zip(data.column("id").to_pylist(), data.column("payload").to_pylist())):
+        if old_id in seen:
+            continue
+        seen.add(old_id)
+        payload = json.loads(raw)
+        meta = payload.get("meta_data") or {}
+        row = _extras_from_payload(payload)
+        group = row["file_hash"] or payload.get("content_hash") or row["file_name"]
+        chunk = meta.get("chunk")
+        if chunk is None:
+            n = ordinals.get((group, row["page"]), 0)
+            ordinals[(group, row["page"])] = n + 1
+            chunk = f"legacy{n}"
+        new_id = row_id(group, row["page"], chunk)
+        if new_id in new_ids:
+            continue
+        new_ids.add(new_id)
+        keep.append(i)
+        ids.append(new_id)
+        extras.append(row)
+
+    base = [c for c in data.column_names if c not in EXTRA_COLUMNS]
+    out = data.take(pa.array(keep, type=pa.int64())).select(base)
+    out = out.set_column(out.column_names.index("id"), "id", pa.array(ids, type=pa.string()))
+    for name, typ in EXTRA_COLUMNS.items():
+        out = out.append_column(pa.field(name, typ), pa.array([e[name] for e in extras], type=typ))
+    out = out.replace_schema_metadata({**(data.schema.metadata or {}), SCHEMA_KEY: SCHEMA_VERSION})
+
+    print(f"Rebuilding riverai_kb: {data.num_rows} rows -> {out.num_rows} with {list(EXTRA_COLUMNS)}")
+    new_table = vector_db.connection.create_table(table.name, out, mode="overwrite")
+    # Handles opened before the overwrite still see the old schema
+    vector_db.table = new_table
+    if getattr(vector_db, "async_table", None) is not None:
+        vector_db.async_table = None
+    return out.num_rows
+
+
+def ensure_kb_schema(vector_db) -> None:
+    """Make sure riverai_kb has EXTRA_COLUMNS filled for every row (see rebuild_kb_table)."""
+    if getattr(vector_db, "table", None) is None or schema_ready(vector_db.table):
+        return
+    with _schema_lock:
+        if schema_ready(vector_db.table):
+            return
+        rebuild_kb_table(vector_db)
+
+
+def ensure_fts_index(table) -> None:
+    if table is None or _fts_ready.get(id(table)):
+        return
+    if not any("text" in list(getattr(i, "columns", []) or []) for i in table.list_indices()):
+        # n-grams rather than whitespace tokens, which would not split Chinese text
+        table.create_fts_index(
+            "text", replace=True, base_tokenizer="ngram",
+            ngram_min_length=2, ngram_max_length=3,
+            stem=False, remove_stop_words=False, ascii_folding=False,
+        )
+    _fts_ready[id(table)] = True
+
+
+def add_documents(vector_db, documents: List[Document], content_hash: str) -> None:
+    """Insert already-embedded documents, filling agno's columns plus EXTRA_COLUMNS."""
+    table = vector_db.table
+    names = set(table.schema.names)
+    rows = []
+    for doc in documents:
+        content = doc.content.replace("\x00", "\ufffd")
+        meta = doc.meta_data or {}
+        payload = {
+            "name": doc.name,
+            "meta_data": doc.meta_data,
+            "content": content,
+            "usage": doc.usage,
+            "content_id": doc.content_id,
+            "content_hash": content_hash,
+        }
+        extras = _extras_from_payload(payload)
+        extras["file_hash"] = extras["file_hash"] or content_hash
+        chunk = meta.get("chunk")
+        if chunk is None:
+            # Not from chunk_pages: key on the text within this file
+            chunk = doc.id or md5(content.encode()).hexdigest()
+        row = {
+            "id": row_id(content_hash, extras["page"], chunk),
+            "vector": [float(x) for x in doc.embedding],
+            "payload": json.dumps(payload),
+            **extras,
+        }
+        if "user_id" in names:
+            row["user_id"] = None
+        rows.append(row)
+    if rows:
+        table.add(rows)
+
+
+def _sql_str(value: Any) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def filters_to_where(filters: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Translate {"file_name": ..., "page": n | [first, last]} into a LanceDB predicate.
+
+    Returns None for no filters; raises ValueError for keys it cannot pre-filter on.
+    """
+    if not filters:
+        return None
+    clauses = []
+    for key, value in filters.items():
+        if key == "file_name":
+            if isinstance(value, (list, tuple)):
+                clauses.append(f"file_name IN ({', '.join(_sql_str(v) for v in value)})")
+            else:
+                clauses.append(f"file_name = {_sql_str(value)}")
+        elif key == "page":
+            if isinstance(value, (list, tuple)) and len(value) == 2:
+                clauses.append(f"page BETWEEN {int(value[0])} AND {int(value[1])}")
+            else:
+                clauses.append(f"page = {int(value)}")
+        else:
+            raise ValueError(f"unsupported filter: {key}")
+    return " AND ".join(clauses)
+
+
+def hybrid_search(vector_db, query: str, limit: int, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+    """Dense + FTS search over riverai_kb, pre-filtered by metadata and fused with
+    reciprocal rank fusion."""
+    table = vector_db.table
+    where = filters_to_where(filters)
+    candidates = max(limit, HYBRID_CANDIDATES)
+    columns = ["id", "payload"]
+
+    vector = vector_db.embedder.get_embedding(query)
+    with stage("vector_search"):
+        vq = table.search(vector, vector_column_name="vector").limit(candidates)
+        vq = vq.distance_type("cosine") if hasattr(vq, "distance_type") else vq.metric("cosine")
+        if KB_NPROBES:
+            vq = vq.nprobes(KB_NPROBES)
+        if where:
+            vq = vq.where(where, prefilter=True)
+        dense = vq.select(columns).to_list()
+
+    try:
+        with stage("fts_search"):
+            ensure_fts_index(table)
+            fq = table.search(query, query_type="fts", fts_columns="text").limit(candidates)
+            if where:
+                fq = fq.where(where, prefilter=True)
+            keyword = fq.select(columns).to_list()
+    except Exception as e:
+        # Keyword search is an enhancement; dense results alone are still valid
+        print(f"FTS search failed, using vector results only: {e}")
+        keyword = []
+
+    scores: Dict[str, float] = {}
+    payloads: Dict[str, str] = {}
+    for ranked in (dense, keyword):
+        for rank, row in enumerate(ranked):
+            scores[row["id"]] = scores.get(row["id"], 0.0) + 1.0 / (HYBRID_RRF_K + rank + 1)
+            payloads[row["id"]] = row["payload"]
+
+    docs = []
+    for doc_id in sorted(scores, key=scores.get, reverse=True)[:limit]:
+        payload = json.loads(payloads[doc_id])
+        docs.append(
+            Document(
+                name=payload.get("name"),
+                meta_data={**(payload.get("meta_data") or {}), "score": round(scores[doc_id], 6)},
+                content=payload.get("content", ""),
+                content_id=payload.get("content_id"),
+            )
+        )
+    return docs
+
+
+class HybridKnowledge(CachedKnowledge):
+    """CachedKnowledge whose misses go through hybrid_search when the table supports it."""
+
+    def _hybrid_ready(self, filters: Any) -> bool:
+        table = getattr(self.vector_db, "table", None)
+        if filters is not None and not (isinstance(filters, dict) and set(filters) <= FILTER_KEYS):
+            # Other filter shapes (agno FilterExpr lists, other metadata keys) use agno's search
+            return False
+        return schema_ready(table)
+
+    def _limit(self, max_results: Optional[int]) -> int:
+        return max_results or getattr(self, "max_results", None) or 10
+
+    def _retrieve(self, query: str, max_results: Optional[int], filters: Any, **kwargs: Any):
+        if self._hybrid_ready(filters):
+            return hybrid_search(self.vector_db, query, self._limit(max_results), filters)
+        return super()._retrieve(query, max_results, filters, **kwargs)
+
+    async def _aretrieve(self, query: str, max_results: Optional[int], filters: Any, method: str, **kwargs: Any):
+        if self._hybrid_ready(filters):
+            return await asyncio.to_thread(hybrid_search, self.vector_db, query, self._limit(max_results), filters)
+        return await super()._aretrieve(query, max_results, filters, method, **kwargs)
@@ -0,0 +1,139 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from agno.knowledge import Knowledge
+
+from ..core.config import QUERY_CACHE_SIZE, QUERY_CACHE_TTL, RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL
+from ..core.metrics import Callback, stage
+from .embed_cache import text_key
+
+
+class TTLCache:
+    """Thread-safe LRU with per-entry expiry and hit/miss counters."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = max(maxsize, 1)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires = item
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+query_embeddings = TTLCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+retrieval_results = TTLCache(RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL)
+
+
+def _lookup_counts():
+    for name, cache in (("query_embeddings", query_embeddings), ("retrieval_results", retrieval_results)):
+        yield (name, "hit"), cache.hits
+        yield (name, "miss"), cache.misses
+
+
+Callback("riverai_cache_lookups_total", "In-memory query cache lookups.", ("cache", "result"), _lookup_counts, kind="counter")
+
+_kb_version = 0
+_version_lock = threading.Lock()
+
+
+def kb_version() -> int:
+    return _kb_version
+
+
+def bump_kb_version() -> None:
+    """Called whenever ingestion changes the riverai_kb table."""
+    global _kb_version
+    with _version_lock:
+        _kb_version += 1
+    # Old keys can never match again; free them now
+    retrieval_results.clear()
+
+
+def retrieval_key(query: str, max_results: Optional[int], filters: Any, **kwargs: Any) -> Hashable:
+    stable = {k: kwargs.get(k) for k in ("search_type", "user_id")}
+    return (
+        kb_version(),
+        text_key(query),
+        max_results,
+        json.dumps(filters, sort_keys=True, ensure_ascii=False, default=str),
+        json.dumps(stable, sort_keys=True, default=str),
+    )
+
+
+def cache_stats() -> Dict[str, Any]:
+    return {
+        "kb_version": kb_version(),
+        "query_embeddings": query_embeddings.stats(),
+        "retrieval_results": retrieval_results.stats(),
+    }
+
+
+class CachedKnowledge(Knowledge):
+    """Knowledge whose searches are served from retrieval_results when possible."""
+
+    def _retrieve(self, query: str, max_results: Optional[int], filters: Any, **kwargs: Any):
+        return super().search(query, max_results=max_results, filters=filters, **kwargs)
+
+    async def _aretrieve(self, query: str, max_results: Optional[int], filters: Any, method: str, **kwargs: Any):
+        return await getattr(super(), method)(query, max_results=max_results, filters=filters, **kwargs)
+
+    def search(self, query: str, max_results: Optional[int] = None, filters: Any = None, **kwargs: Any):
+        key = retrieval_key(query, max_results, filters, **kwargs)
+        docs = retrieval_results.get(key)
+        if docs is None:
+            with stage("retrieval"):
+                docs = self._retrieve(query, max_results, filters, **kwargs)
+            retrieval_results.put(key, list(docs))
+        return list(docs)
+
+    async def _acached(self, method: str, query: str, max_results: Optional[int], filters: Any, **kwargs: Any):
+        key = retrieval_key(query, max_results, filters, **kwargs)
+        docs = retrieval_results.get(key)
+        if docs is None:
+            with stage("retrieval"):
+                docs = await self._aretrieve(query, max_results, filters, method, **kwargs)
+            retrieval_results.put(key, list(docs))
+        return list(docs)
+
+    async def asearch(self, query: str, max_results: Optional[int] = None, filters: Any = None, **kwargs: Any):
+        return await self._acached("asearch", query, max_results, filters, **kwargs)
+
+    # Older agno releases name the async variant async_search
+    async def async_search(self, query: str, max_results: Optional[int] = None, filters: Any = None, **kwargs: Any):
+        return await self._acached("async_search", query, max_results, filters, **kwargs)
@@ -1,23 +1,54 @@
+import asyncio
+import inspect
 import os
-from typing import Generator, Dict, Any, List
+import threading
+import time
+from typing import AsyncGenerator, Callable, Dict, Any, Iterable, Iterator, List, Sequence
+import numpy as np
 from agno.agent import Agent
 from agno.models.openai import OpenAIChat
 # from agno.knowledge.embedder.openai import OpenAIEmbedder
-from agno.knowledge.embedder.fastembed import FastEmbedEmbedder
 from agno.vectordb.lancedb import LanceDb
 from agno.knowledge import Knowledge
 from agno.knowledge.document import Document
 from agno.knowledge.embedder.base import Embedder
-from ..core.config import LANCEDB_DIR, UPLOADS_DIR, DEEPSEEK_API_KEY, DEEPSEEK_BASE_URL, DEEPSEEK_MODEL, DATA_DIR
+from ..core.config import (
+    LANCEDB_DIR, UPLOADS_DIR, DEEPSEEK_API_KEY, DEEPSEEK_BASE_URL, DEEPSEEK_MODEL,
+    MODELS_DIR, EMBED_MODEL_ID, EMBED_DIMENSIONS, EMBED_BATCH_SIZE, EMBED_PARALLEL,
+    INGEST_MAX_INFLIGHT, EMBED_CACHE_PATH, EMBED_CACHE_MAX_MB, KB_NPROBES, HISTORY_SUMMARY_TOKENS,
+    STREAM_FRAME_MS, STREAM_FRAME_CHARS, REFERENCE_SNIPPET_CHARS,
+)
 from ..core.db import get_session
+from ..core.metrics import Counter, Histogram, SIZE_BUCKETS, RATE_BUCKETS, stage
 from sqlmodel import select
 from ..db.models import DocumentRegistry
-from ..utils.pdf import load_pdf_chunks
+from ..utils.pdf import iter_pdf_pages
+from ..utils.chunking import chunk_pages
+from ..utils.hashing import file_sha256
+from .embed_cache import EmbeddingCache, split_cached, text_key
+from .retrieval_cache import query_embeddings, bump_kb_version
+from .retrieval import HybridKnowledge, add_documents, ensure_kb_schema
 from datetime import datetime
 
+
+embed_batch_size = Histogram("riverai_embed_batch_texts", "Texts per embedding model call.", buckets=SIZE_BUCKETS)
+llm_ttft_seconds = Histogram(
+    "riverai_llm_ttft_seconds",
+    "Time from starting the agent run to the first streamed token.",
+    ("prefetched",),
+)
+llm_tokens_per_second = Histogram(
+    "riverai_llm_tokens_per_second",
+    "Streaming rate after the first token (upstream deltas, roughly one token each).",
+    buckets=RATE_BUCKETS,
+)
+llm_stream_chunks = Counter("riverai_llm_stream_chunks_total", "Content deltas received from the LLM.")
+
 # Define LocalFastEmbedEmbedder to support custom cache directory
 class LocalFastEmbedEmbedder(Embedder):
-    def __init__(self, id: str = "BAAI/bge-small-zh-v1.5", dimensions: int = 512, cache_dir: str = None):
+    def __init__(self, id: str = "BAAI/bge-small-zh-v1.5", dimensions: int = 512, cache_dir: str = None,
+                 batch_size: int = EMBED_BATCH_SIZE, parallel: int | None = EMBED_PARALLEL,
+                 cache: EmbeddingCache | None = None):
         try:
             from fastembed import TextEmbedding
         except ImportError:
@@ -26,13 +57,60 @@ class LocalFastEmbedEmbedder(Embedder):
         self.id = id
         self.dimensions = dimensions
         self.cache_dir = cache_dir
+        self.batch_size = batch_size
+        self.parallel = parallel
+        # Persistent vectors for texts embedded before (re-ingests, KB rebuilds)
+        self.cache = cache
+        # Lets agno's LanceDb.async_insert use the batch path below
+        self.enable_batch = True
         # Initialize model once
         self.model = TextEmbedding(model_name=id, cache_dir=cache_dir)
+
+    def _embed(self, texts: List[str], batch_size: int | None) -> np.ndarray:
+        out = np.empty((len(texts), self.dimensions), dtype=np.float32)
+        if not texts:
+            return out
+        embed_batch_size.observe(len(texts))
+        with stage("embed"):
+            vectors = self.model.embed(texts, batch_size=batch_size or self.batch_size, parallel=self.parallel)
+            # fastembed yields one numpy row per text; copy straight into the preallocated matrix
+            for i, vec in enumerate(vectors):
+                out[i] = vec
+        return out
+
+    def get_embeddings(self, texts: Sequence[str], batch_size: int | None = None, use_cache: bool = True) -> np.ndarray:
+        """Embed texts in batches and return a contiguous (n, dimensions) float32 matrix."""
+        texts = list(texts)
+        if self.cache is None or not use_cache or not texts:
+            return self._embed(texts, batch_size)
+
+        keys, found, missing = split_cached(self.cache, self.id, texts, self.dimensions)
+        out = np.empty((len(texts), self.dimensions), dtype=np.float32)
+        for i, k in enumerate(keys):
+            if k in found:
+                out[i] = found[k]
+        if missing:
+            # Embed each distinct missing text once
+            first = {}
+            for i in missing:
+                first.setdefault(keys[i], i)
+            todo = list(first.values())
+            fresh = self._embed([texts[i] for i in todo], batch_size)
+            self.cache.put_many(self.id, [keys[i] for i in todo], fresh)
+            row = {keys[i]: fresh[n] for n, i in enumerate(todo)}
+            for i in missing:
+                out[i] = row[keys[i]]
+        return out
         
     def get_embedding(self, text: str) -> List[float]:
-        embeddings = self.model.embed(text)
-        # fastembed returns a generator of numpy arrays or lists
-        return list(list(embeddings)[0])
+        # Query path: in-memory LRU only, not worth a disk round trip
+        key = (self.id, text_key(text))
+        vec = query_embeddings.get(key)
+        if vec is None:
+            with stage("query_embed"):
+                vec = self.get_embeddings([text], use_cache=False)[0].tolist()
+            query_embeddings.put(key, vec)
+        return list(vec)
         
     def get_embedding_and_usage(self, text: str):
         return self.get_embedding(text), None
@@ -42,31 +120,70 @@ class LocalFastEmbedEmbedder(Embedder):
         loop = asyncio.get_event_loop()
         return await loop.run_in_executor(None, self.get_embedding, text)
 
-def build_kb(embedder: LocalFastEmbedEmbedder | None = None) -> Knowledge:
+    def get_embeddings_batch_and_usage(self, texts: List[str]):
+        matrix = self.get_embeddings(texts)
+        return list(matrix), [None] * len(texts)
+
+    async def async_get_embeddings_batch_and_usage(self, texts: List[str]):
+        import asyncio
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.get_embeddings_batch_and_usage, texts)
+
+
+def embed_documents(embedder: LocalFastEmbedEmbedder, documents: List[Document], batch_size: int | None = None) -> None:
+    """Fill ``Document.embedding`` in batches so LanceDb.insert skips per-document embedding."""
+    if not documents:
+        return
+    matrix = embedder.get_embeddings([d.content for d in documents], batch_size=batch_size)
+    for doc, vec in zip(documents, matrix):
+        doc.embedding = vec
+        doc.usage = None
+
+
+def build_embedder() -> LocalFastEmbedEmbedder:
+    # Use LocalFastEmbedEmbedder with specific cache directory
+    models_dir = MODELS_DIR.as_posix()
+    os.makedirs(models_dir, exist_ok=True)
+    print(f"Using local model cache: {models_dir}")
+    cache = None
+    if EMBED_CACHE_MAX_MB > 0:
+        cache = EmbeddingCache(EMBED_CACHE_PATH.as_posix(), max_bytes=EMBED_CACHE_MAX_MB * 1024 * 1024)
+    return LocalFastEmbedEmbedder(
+        id=EMBED_MODEL_ID,
+        dimensions=EMBED_DIMENSIONS,
+        cache_dir=models_dir,
+        cache=cache,
+    )
+
+
+def build_kb(embedder: LocalFastEmbedEmbedder | None = None, connection=None) -> Knowledge:
+    # Prefer the process-wide instances from agents.registry; building here
+    # without arguments loads a fresh ONNX model and opens a new connection.
     if embedder is None:
-        # Use LocalFastEmbedEmbedder with specific cache directory
-        models_dir = (DATA_DIR / "models").as_posix()
-        os.makedirs(models_dir, exist_ok=True)
-        print(f"Using local model cache: {models_dir}")
-        embedder = LocalFastEmbedEmbedder(
-            id="BAAI/bge-small-zh-v1.5", 
-            dimensions=512,
-            cache_dir=models_dir
-        )
+        embedder = build_embedder()
         
     vector_db = LanceDb(
         table_name="riverai_kb",
         uri=os.path.abspath(LANCEDB_DIR.as_posix()),
+        connection=connection,
         embedder=embedder,
+        nprobes=KB_NPROBES,
     )
     
-    kb = Knowledge(vector_db=vector_db)
+    # Hybrid (vector + FTS) search, cached per (query, kb version); ingestion bumps the version
+    kb = HybridKnowledge(vector_db=vector_db)
     return kb
 
 
-from ..tools.water import extract_water_body
+from ..tools.water import extract_water_body, extract_water_bodies
 
-def build_agent(api_base_url: str | None, api_key: str | None, mode: str = "chat") -> Agent:
+def build_agent(
+    api_base_url: str | None,
+    api_key: str | None,
+    mode: str = "chat",
+    kb: Knowledge | None = None,
+    search_knowledge: bool = True,
+) -> Agent:
     # Prefer provided args, fallback to env vars
     base_url = api_base_url or DEEPSEEK_BASE_URL
     key = api_key or DEEPSEEK_API_KEY
@@ -93,14 +210,15 @@ def build_agent(api_base_url: str | None, api_key: str | None, mode: str = "chat
     # Initialize Knowledge Base
     # We use a default embedder here. In a real scenario, we might want to configure this.
     # If using DeepSeek, we might need a separate OpenAI Key for embeddings or use a local one.
-    kb = build_kb()
+    if kb is None:
+        kb = build_kb()
     
     # memory = SQLiteSessionMemory(namespace="river_shoreline")
     
     agent_tools = []
     if mode == "agent":
         # Enable tools only in agent mode
-        agent_tools = [extract_water_body]
+        agent_tools = [extract_water_body, extract_water_bodies]
     else:
         # Chat mode - no tools or basic tools
         agent_tools = []
@@ -114,7 +232,8 @@ def build_agent(api_base_url: str | None, api_key: str | None, mode: str = "chat
         # function_calling=True, # DeepSeek V3 supports function calling
         markdown=True,
         # memory=memory,
-        search_knowledge=True, # Enable searching knowledge base
+        # Off when the caller already injects retrieved passages (prefetch hit)
+        search_knowledge=search_knowledge,
         instructions=[
             "When a tool returns an image path or URL (e.g., in 'overlay_image'), you MUST display it using Markdown image syntax: ![Result Image](<url>).",
             "Do not just say 'the image is ready', show it.",
@@ -124,168 +243,403 @@ def build_agent(api_base_url: str | None, api_key: str | None, mode: str = "chat
     return agent
 
 
-def ingest_pdf_file(kb: Knowledge, pdf_path: str) -> Dict[str, Any]:
-    raw_docs = load_pdf_chunks(pdf_path)
-    if not raw_docs:
-        return {"ingested": 0, "file": pdf_path}
-    
-    documents = [
-        Document(content=d["text"], meta_data=d["metadata"]) 
-        for d in raw_docs
-    ]
-    
+def build_summarizer(agent: Agent) -> Callable[[str, List[Dict[str, str]]], str]:
+    """Rolling-summary function for ConversationHistory, using the chat agent's model."""
+
+    def summarize(previous: str, turns: List[Dict[str, str]]) -> str:
+        summarizer = Agent(
+            name="HistorySummarizer",
+            model=agent.model,
+            markdown=False,
+            instructions=[
+                "You maintain a running summary of a conversation about river shoreline analysis.",
+                "Merge the new turns into the existing summary. Keep facts, file names, places, "
+                "parameters and results the user may refer back to; drop pleasantries.",
+                f"Reply with the updated summary only, in the conversation's language, under {HISTORY_SUMMARY_TOKENS} tokens.",
+            ],
+        )
+        lines = [f"{t['role']}: {t['content']}" for t in turns]
+        prompt = f"Existing summary:\n{previous or '(none)'}\n\nNew turns:\n" + "\n".join(lines)
+        content = summarizer.run(prompt).content
+        if not isinstance(content, str) or not content.strip():
+            raise ValueError("empty summary")
+        return content.strip()
+
+    return summarize
+
+
+def insert_documents(kb: Knowledge, documents: List[Document], content_hash: str) -> None:
+    # Embed in batches up front; LanceDb.insert only embeds documents without a vector
+    embedder = getattr(kb.vector_db, "embedder", None)
+    table = getattr(kb.vector_db, "table", None)
+    if isinstance(embedder, LocalFastEmbedEmbedder):
+        embed_documents(embedder, documents)
+        if table is not None:
+            # Write rows ourselves so the file_name/page/text columns used by
+            # hybrid retrieval are filled alongside agno's payload
+            ensure_kb_schema(kb.vector_db)
+            add_documents(kb.vector_db, documents, content_hash)
+            bump_kb_version()
+            return
+
     if hasattr(kb, 'load_documents'):
         kb.load_documents(documents=documents, upsert=True)
     elif hasattr(kb, 'load'):
         kb.load(documents=documents, recreate=False)
     else:
-                         # Fallback for newer Agno versions where loading might be done differently
+        # Fallback for newer Agno versions where loading might be done differently
         # Attempting to use add_documents or similar if available, otherwise checking source
         try:
              # Try direct vector_db insertion if kb.load/load_documents missing
              if kb.vector_db:
-                 import hashlib
-                 content_hash = hashlib.md5(pdf_path.encode()).hexdigest()
-                 
                  # Ensure we are calling the correct method for LanceDb
                  # Check if insert method exists
                  if hasattr(kb.vector_db, 'insert'):
-                     kb.vector_db.insert(documents=documents)
+                     kb.vector_db.insert(content_hash=content_hash, documents=documents)
                  elif hasattr(kb.vector_db, 'add_documents'):
                      kb.vector_db.add_documents(documents=documents)
                  elif hasattr(kb.vector_db, 'upsert'):
-                     kb.vector_db.upsert(documents=documents)
+                     kb.vector_db.upsert(content_hash=content_hash, documents=documents)
                  else:
                      print("Warning: No suitable method found to insert documents into VectorDB")
                      
         except Exception as e:
             print(f"Error loading documents: {e}")
             raise
-    return {"ingested": len(documents), "file": pdf_path}
+    bump_kb_version()
+
+
+def _batched(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ingest_pdf_file(
+    kb: Knowledge,
+    pdf_path: str,
+    parse: Callable[[str], Iterable[Dict[str, Any]]] | None = None,
+    on_chunks: Callable[[int], None] | None = None,
+    file_hash: str | None = None,
+) -> Dict[str, Any]:
+    # Generator pipeline: extract -> chunk -> Document -> embed -> insert, one batch
+    # at a time, so at most INGEST_MAX_INFLIGHT chunks (text + vectors) are held in memory.
+    # parse lets callers wrap extraction (e.g. to count pages); it must yield page dicts.
+    raw_docs = chunk_pages((parse or iter_pdf_pages)(pdf_path))
+    content_hash = file_hash or file_sha256(pdf_path)
+    # file_hash in meta_data lets delete_document_vectors find every chunk of this content
+    documents = (
+        Document(content=d["text"], meta_data={**d["metadata"], "file_hash": content_hash}) 
+        for d in raw_docs
+    )
+
+    total = 0
+    for batch in _batched(documents, max(INGEST_MAX_INFLIGHT, 1)):
+        insert_documents(kb, batch, content_hash)
+        total += len(batch)
+        if on_chunks:
+            on_chunks(len(batch))
+    return {"ingested": total, "file": pdf_path}
+
+
+def delete_document_vectors(kb: Knowledge, file_hash: str | None = None, file_name: str | None = None) -> None:
+    """Remove a document's chunks from the riverai_kb table."""
+    vector_db = kb.vector_db
+    if getattr(vector_db, "table", None) is None:
+        return
+    # Filter on the real columns instead of the payload JSON
+    ensure_kb_schema(vector_db)
+    table = vector_db.table
+    if file_hash:
+        # Hex digest, safe to inline
+        table.delete(f"file_hash = '{file_hash}'")
+    if file_name:
+        # Rows ingested before file_hash was recorded
+        quoted = file_name.replace("'", "''")
+        table.delete(f"file_hash IS NULL AND file_name = '{quoted}'")
+    bump_kb_version()
+
 
+# Ingestion jobs run concurrently (INGEST_WORKERS); one lock per content hash keeps
+# the duplicate check, the embedding and the registry update of the same bytes serial
+_hash_locks: Dict[str, threading.Lock] = {}
+_hash_locks_guard = threading.Lock()
 
-def ingest_uploads(kb: Knowledge) -> Dict[str, Any]:
+
+def _hash_lock(file_hash: str | None) -> threading.Lock:
+    with _hash_locks_guard:
+        return _hash_locks.setdefault(file_hash or "", threading.Lock())
+
+
+def ingest_uploads(
+    kb: Knowledge,
+    only: List[str] | None = None,
+    parse: Callable[[str], Iterable[Dict[str, Any]]] | None = None,
+    on_chunks: Callable[[int], None] | None = None,
+) -> Dict[str, Any]:
     os.makedirs(UPLOADS_DIR.as_posix(), exist_ok=True)
     
     # 1. Scan files
-    files_on_disk = []
-    for fn in os.listdir(UPLOADS_DIR):
-        if fn.lower().endswith(".pdf"):
-            files_on_disk.append(fn)
+    files_on_disk = {}
+    for entry in os.scandir(UPLOADS_DIR):
+        fn = entry.name
+        if entry.is_file() and fn.lower().endswith(".pdf") and (only is None or fn in only):
+            files_on_disk[fn] = entry.stat()
             
     total_chunks = 0
     new_files = []
+    skipped = []
+    failed = {}
     
     with get_session() as s:
-        for fn in files_on_disk:
+        # 2. One bulk registry lookup per scan
+        rows = s.exec(select(DocumentRegistry)).all()
+        by_name = {r.filename: r for r in rows}
+
+        def hash_used_elsewhere(file_hash: str | None, fn: str, ingested_only: bool = False) -> bool:
+            # Read the registry again rather than the scan: another job may have
+            # registered (or dropped) the same content since. Call under _hash_lock
+            if not file_hash:
+                return False
+            q = select(DocumentRegistry.filename).where(
+                DocumentRegistry.file_hash == file_hash, DocumentRegistry.filename != fn)
+            if ingested_only:
+                q = q.where(DocumentRegistry.ingested == True)  # noqa: E712
+            return s.exec(q).first() is not None
+
+        # 3. Files removed from disk (of those scanned): drop their vectors and registry rows
+        for fn, row in list(by_name.items()):
+            if fn in files_on_disk or (only is not None and fn not in only):
+                continue
+            print(f"Removing deleted file: {fn}")
+            with _hash_lock(row.file_hash):
+                if row.ingested and not hash_used_elsewhere(row.file_hash, fn):
+                    delete_document_vectors(kb, row.file_hash, fn)
+                s.delete(row)
+                s.commit()
+            del by_name[fn]
+
+        for fn, st in files_on_disk.items():
             file_path = (UPLOADS_DIR / fn).as_posix()
-            
-            # Check if already ingested
-            existing = s.exec(select(DocumentRegistry).where(DocumentRegistry.filename == fn)).first()
-            
-            if existing and existing.ingested:
-                print(f"Skipping already ingested file: {fn}")
+            existing = by_name.get(fn)
+
+            # Unchanged size and mtime: trust the registry without re-hashing
+            if (existing and existing.ingested and existing.file_hash
+                    and existing.file_size == st.st_size and existing.file_mtime == st.st_mtime):
+                skipped.append(fn)
                 continue
-                
-            print(f"Ingesting new file: {fn}")
-            
+
+            file_hash = file_sha256(file_path)
+            if existing and existing.ingested and existing.file_hash == file_hash:
+                existing.file_size, existing.file_mtime = st.st_size, st.st_mtime
+                s.add(existing)
+                s.commit()
+                skipped.append(fn)
+                continue
+
             # Create or update registry entry
             if not existing:
                 doc_reg = DocumentRegistry(filename=fn, file_path=file_path)
-                s.add(doc_reg)
-                s.commit()
-                s.refresh(doc_reg)
+                by_name[fn] = doc_reg
             else:
                 doc_reg = existing
+            old_hash, was_ingested = doc_reg.file_hash, doc_reg.ingested
 
             try:
-                # Ingest
-                res = ingest_pdf_file(kb, file_path)
-                
-                # Update status
-                doc_reg.ingested = True
-                doc_reg.ingested_at = datetime.utcnow()
-                s.add(doc_reg)
-                s.commit()
-                
-                total_chunks += res["ingested"]
-                new_files.append(fn)
-                
+                if was_ingested:
+                    with _hash_lock(old_hash):
+                        # Mark stale first so a failed re-ingest is retried on the next scan
+                        doc_reg.ingested = False
+                        s.add(doc_reg)
+                        s.commit()
+                        if not hash_used_elsewhere(old_hash, fn):
+                            print(f"Removing stale vectors of changed file: {fn}")
+                            delete_document_vectors(kb, old_hash, fn)
+
+                # A job with the same content under another name waits here, then
+                # finds this row ingested and skips instead of embedding it twice
+                with _hash_lock(file_hash):
+                    duplicate = hash_used_elsewhere(file_hash, fn, ingested_only=True)
+                    res = {"ingested": 0}
+                    if duplicate:
+                        # Same content already embedded under another name
+                        print(f"Skipping duplicate of an ingested file: {fn}")
+                    else:
+                        print(f"Ingesting new file: {fn}")
+                        res = ingest_pdf_file(kb, file_path, parse=parse, on_chunks=on_chunks, file_hash=file_hash)
+
+                    # Update status
+                    doc_reg.file_path = file_path
+                    doc_reg.file_hash = file_hash
+                    doc_reg.file_size, doc_reg.file_mtime = st.st_size, st.st_mtime
+                    doc_reg.ingested = True
+                    doc_reg.ingested_at = datetime.utcnow()
+                    s.add(doc_reg)
+                    s.commit()
+
+                if duplicate:
+                    skipped.append(fn)
+                else:
+                    total_chunks += res["ingested"]
+                    new_files.append(fn)
+
             except Exception as e:
                 print(f"Failed to ingest {fn}: {e}")
+                s.rollback()
+                failed[fn] = str(e)
     
-    return {"files": new_files, "chunks": total_chunks}
-
-
-def stream_agent(agent: Agent, prompt: str, session_id: str) -> Generator[Dict[str, Any], None, None]:
-    for chunk in agent.run(prompt, stream=True, session_id=session_id):
-        # Handle RunContentEvent
-        data = {}
-        if hasattr(chunk, "content"):
-             data["content"] = chunk.content
-             if hasattr(chunk, "references") and chunk.references:
-                 # Flatten references: Extract documents from MessageReferences
-                 flattened_docs = []
-                 for ref_obj in chunk.references:
-                     # Check if it's a MessageReferences object (which has a 'references' list attribute)
-                     if hasattr(ref_obj, "references") and isinstance(ref_obj.references, list):
-                         flattened_docs.extend(ref_obj.references)
-                     else:
-                         # It might be a direct Document object or dict
-                         flattened_docs.append(ref_obj)
-                         
-                 # Serialize the flattened list
-                 serialized_refs = []
-                 for doc in flattened_docs:
-                     if hasattr(doc, "to_dict"):
-                         serialized_refs.append(doc.to_dict())
-                     elif hasattr(doc, "__dict__"):
-                         serialized_refs.append(doc.__dict__)
-                     else:
-                         serialized_refs.append(str(doc))
-                         
-                 # Deduplicate references based on filename
-                 seen_files = set()
-                 unique_refs = []
-                 for doc in serialized_refs:
-                     # Try to get filename from meta_data or file_name attribute
-                     file_name = None
-                     if isinstance(doc, dict):
-                         meta_data = doc.get('meta_data', {})
-                         file_name = meta_data.get('file_name') or doc.get('file_name')
-                     
-                     if file_name:
-                         if file_name not in seen_files:
-                             seen_files.add(file_name)
-                             unique_refs.append(doc)
-                     else:
-                         # If no filename, just add it (or decide to skip)
-                         unique_refs.append(doc)
-                 
-                 data["references"] = unique_refs
-                 # Debug log to verify references are being sent
-                 print(f"DEBUG: Sending {len(unique_refs)} unique references in stream chunk")
-                 
-             if hasattr(chunk, "citations") and chunk.citations:
-                 # Serialize citations to dict if they are objects
-                 serialized_cits = []
-                 for cit in chunk.citations:
-                     if hasattr(cit, "to_dict"):
-                         serialized_cits.append(cit.to_dict())
-                     elif hasattr(cit, "__dict__"):
-                         serialized_cits.append(cit.__dict__)
-                     else:
-                         serialized_cits.append(str(cit))
-                 data["citations"] = serialized_cits
-        elif isinstance(chunk, str):
-            data["content"] = chunk
+    return {"files": new_files, "chunks": total_chunks, "skipped": skipped, "failed": failed}
+
+
+def _flatten_references(references: Iterable[Any]) -> List[Any]:
+    # agno wraps retrieved documents in MessageReferences(references=[...])
+    docs: List[Any] = []
+    for ref_obj in references or []:
+        if hasattr(ref_obj, "references") and isinstance(ref_obj.references, list):
+            docs.extend(ref_obj.references)
         else:
-            # Check for specific agno types that might need string conversion
+            docs.append(ref_obj)
+    return docs
+
+
+def compact_reference(doc: Any) -> Dict[str, Any]:
+    """{file_name, page, score, snippet} for a Document or document dict."""
+    if isinstance(doc, dict):
+        meta = doc.get("meta_data") or {}
+        content = doc.get("content") or ""
+    else:
+        meta = getattr(doc, "meta_data", None) or {}
+        content = getattr(doc, "content", None) or ""
+        doc = {"reranking_score": getattr(doc, "reranking_score", None)}
+    # hybrid_search puts its fused score in meta_data; rerankers set reranking_score
+    score = meta.get("score")
+    if score is None:
+        score = doc.get("score")
+    if score is None:
+        score = doc.get("reranking_score")
+    return {
+        "file_name": meta.get("file_name") or doc.get("file_name"),
+        "page": meta.get("page") or doc.get("page"),
+        "score": round(score, 4) if isinstance(score, (int, float)) else None,
+        "snippet": content[:REFERENCE_SNIPPET_CHARS],
+    }
+
+
+class ReferenceSet:
+    """Compact references for one message, de-duplicated by (file, page)."""
+
+    def __init__(self):
+        self._refs: Dict[Any, Dict[str, Any]] = {}
+
+    def add(self, docs: Iterable[Any]) -> None:
+        for doc in docs:
+            ref = compact_reference(doc)
+            key = (ref["file_name"], ref["page"]) if ref["file_name"] else ref["snippet"]
+            if key not in self._refs:
+                self._refs[key] = ref
+
+    def records(self) -> List[Dict[str, Any]]:
+        return list(self._refs.values())
+
+
+async def astream_agent(
+    agent: Agent,
+    prompt: str,
+    session_id: str,
+    knowledge_filters: Dict[str, Any] | None = None,
+    context_docs: List[Dict[str, Any]] | None = None,
+    history: Dict[str, Any] | None = None,
+    frame_ms: float = STREAM_FRAME_MS,
+    frame_chars: int = STREAM_FRAME_CHARS,
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """Stream an agent reply: awaits the model through agent.arun so the event
+    loop is never blocked. Cancelling the consumer (e.g. client
+    disconnect) closes the run iterator, which aborts the upstream LLM request.
+    knowledge_filters (e.g. {"file_name": ..., "page": [1, 5]}) scope KB searches;
+    context_docs (already-retrieved passages) and history (ConversationHistory.context)
+    are appended to the user message.
+
+    Yields SSE events: "message" frames of {"content"} with tokens coalesced until
+    frame_ms has passed or frame_chars are buffered (frame_ms=0 sends every token),
+    then one "references" event of compact records at the end of the message.
+    """
+    deps: Dict[str, Any] = dict(history or {})
+    if context_docs:
+        deps["knowledge_base_passages"] = context_docs
+    extra: Dict[str, Any] = {"dependencies": deps, "add_dependencies_to_context": True} if deps else {}
+    started = time.perf_counter()
+    first_token = None
+    chunks = 0
+    run = agent.arun(prompt, stream=True, session_id=session_id, knowledge_filters=knowledge_filters, **extra)
+    if inspect.isawaitable(run):
+        run = await run
+
+    refs = ReferenceSet()
+    refs.add(context_docs or [])
+    buf: List[str] = []
+    buffered = 0
+    deadline = 0.0
+    loop = asyncio.get_running_loop()
+    it = run.__aiter__()
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(it.__anext__())
+            timeout = max(deadline - loop.time(), 0) if buf else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                # Frame budget ran out while the model is still thinking
+                yield {"event": "message", "data": {"content": "".join(buf)}}
+                buf, buffered = [], 0
+                continue
             try:
-                data["content"] = str(chunk)
-            except:
-                pass
-            
-        if data:
-            yield data
+                chunk = pending.result()
+            except StopAsyncIteration:
+                pending = None
+                break
+            pending = None
+
+            if getattr(chunk, "references", None):
+                refs.add(_flatten_references(chunk.references))
+            content = chunk if isinstance(chunk, str) else getattr(chunk, "content", None)
+            if not isinstance(content, str) or not content:
+                continue
+            chunks += 1
+            if first_token is None:
+                # Includes any KB search or tool calls the agent makes before answering
+                first_token = time.perf_counter()
+                llm_ttft_seconds.observe(first_token - started, prefetched="yes" if context_docs else "no")
+            if not buf:
+                deadline = loop.time() + frame_ms / 1000
+            buf.append(content)
+            buffered += len(content)
+            if buffered >= frame_chars or frame_ms <= 0:
+                yield {"event": "message", "data": {"content": "".join(buf)}}
+                buf, buffered = [], 0
 
+        if buf:
+            yield {"event": "message", "data": {"content": "".join(buf)}}
+        if first_token is not None and chunks > 1:
+            elapsed = time.perf_counter() - first_token
+            if elapsed > 0:
+                llm_tokens_per_second.observe((chunks - 1) / elapsed)
+        records = refs.records()
+        if records:
+            yield {"event": "references", "data": {"references": records}}
+    finally:
+        llm_stream_chunks.inc(chunks)
+        if pending is not None:
+            pending.cancel()
+            try:
+                await pending
+            except (asyncio.CancelledError, Exception):
+                pass
+        aclose = getattr(run, "aclose", None)
+        if aclose is not None:
+            await aclose()
@@ -4,6 +4,7 @@ from sqlmodel import select
 from passlib.context import CryptContext
 from ..core.db import get_session
 from ..db.models import User
+from ..agents.registry import invalidate_agents
 
 
 router = APIRouter(prefix="/auth", tags=["auth"])
@@ -36,9 +37,13 @@ def update_config(body: ConfigReq):
         u = s.get(User, body.user_id)
         if u is None:
             raise HTTPException(status_code=404, detail="user not found")
+        old_base_url, old_key = u.api_base_url, u.api_key
         u.api_base_url = body.api_base_url
         u.api_key = body.api_key
         s.add(u)
         s.commit()
+        if (old_base_url, old_key) != (body.api_base_url, body.api_key):
+            # Cached agents still hold the old OpenAIChat client
+            invalidate_agents(old_base_url, old_key)
         return {"ok": True}
 
@@ -1,51 +1,143 @@
-from fastapi import APIRouter, HTTPException
-from fastapi import Body
+import json
+from datetime import datetime
+from fastapi import APIRouter, HTTPException, Response
+from fastapi import Body, Query
+from fastapi.concurrency import run_in_threadpool
 from sse_starlette.sse import EventSourceResponse
-from sqlmodel import select
+from sqlmodel import select, or_, and_
+from ..core.config import HISTORY_ENABLED, CONVERSATIONS_PAGE_SIZE, MESSAGES_PAGE_SIZE, PAGE_SIZE_MAX
 from ..core.db import get_session
+from ..core.metrics import stage
 from ..db.models import User, Conversation, Message
-from ..agents.river_agent import build_agent, stream_agent
+from ..db.writer import enqueue_message, messages_before
+from ..db.retention import delete_conversations
+from ..db.search import search_messages
+from ..agents.river_agent import astream_agent, build_summarizer
+from ..agents.memory import history
+from ..agents.registry import get_agent
+from ..agents.retrieval_cache import cache_stats
+from ..agents.prefetch import start_prefetch, take_prefetch, docs_to_context
 
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
 
+@router.get("/retrieval/stats")
+def retrieval_stats():
+    return cache_stats()
+
+
+def _conversation_cursor(updated_at: datetime, cid: int) -> str:
+    return f"{updated_at.isoformat()}_{cid}"
+
+
+def _parse_conversation_cursor(cursor: str):
+    try:
+        ts, cid = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(ts), int(cid)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+
+
 @router.get("/conversations")
-def list_conversations(user_id: int):
+def list_conversations(
+    response: Response,
+    user_id: int,
+    limit: int = Query(CONVERSATIONS_PAGE_SIZE, ge=1, le=PAGE_SIZE_MAX),
+    cursor: str | None = None,
+):
+    # Keyset pagination on (updated_at, id), newest first; the next page's cursor is
+    # returned in X-Next-Cursor so the body stays a plain list.
+    q = select(Conversation.id, Conversation.title, Conversation.mode, Conversation.created_at, Conversation.updated_at).where(
+        Conversation.user_id == user_id
+    )
+    if cursor:
+        ts, cid = _parse_conversation_cursor(cursor)
+        q = q.where(or_(Conversation.updated_at < ts, and_(Conversation.updated_at == ts, Conversation.id < cid)))
+    q = q.order_by(Conversation.updated_at.desc(), Conversation.id.desc()).limit(limit + 1)
     with get_session() as s:
-        cs = s.exec(select(Conversation).where(Conversation.user_id == user_id).order_by(Conversation.updated_at.desc())).all()
-        return [{"id": c.id, "title": c.title, "mode": c.mode, "created_at": c.created_at.isoformat(), "updated_at": c.updated_at.isoformat()} for c in cs]
+        rows = s.exec(q).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = _conversation_cursor(rows[-1].updated_at, rows[-1].id)
+    return [
+        {"id": r.id, "title": r.title, "mode": r.mode, "created_at": r.created_at.isoformat(), "updated_at": r.updated_at.isoformat()}
+        for r in rows
+    ]
+
+
+@router.get("/search")
+def search(user_id: int, q: str, limit: int = Query(20, ge=1, le=100)):
+    return search_messages(user_id, q, limit)
 
 
 @router.delete("/conversations/{conversation_id}")
 def delete_conversation(conversation_id: int):
     with get_session() as s:
-        c = s.get(Conversation, conversation_id)
-        if c:
-            # Delete messages first
-            messages = s.exec(select(Message).where(Message.conversation_id == conversation_id)).all()
-            for m in messages:
-                s.delete(m)
-            # Delete conversation
-            s.delete(c)
-            s.commit()
+        delete_conversations(s, [conversation_id])
+        s.commit()
         return {"ok": True}
 
 
+@router.post("/conversations/delete")
+def delete_conversations_batch(user_id: int = Body(...), ids: list[int] = Body(...)):
+    # Only the caller's own conversations are deleted; other ids are ignored
+    with get_session() as s:
+        owned = s.exec(select(Conversation.id).where(Conversation.user_id == user_id, Conversation.id.in_(ids))).all()
+        deleted = delete_conversations(s, owned)
+        s.commit()
+        return {"ok": True, "deleted": deleted}
+
+
+def _message_metadata(meta_info: str | None) -> dict:
+    # Assistant replies store JSON ({"references": [...]}); older rows hold a bare file name
+    if not meta_info:
+        return {"file_name": None}
+    if meta_info.startswith("{"):
+        try:
+            return json.loads(meta_info)
+        except ValueError:
+            pass
+    return {"file_name": meta_info}
+
+
 @router.get("/conversations/{conversation_id}/messages")
-def get_messages(conversation_id: int):
+def get_messages(
+    response: Response,
+    conversation_id: int,
+    limit: int = Query(MESSAGES_PAGE_SIZE, ge=1, le=PAGE_SIZE_MAX),
+    cursor: int | None = None,
+    brief: bool = False,
+):
+    # Returns the newest `limit` messages before `cursor` (a message id) in chronological
+    # order, i.e. by (created_at, id): write-behind replies can commit after a later
+    # message and get a higher id. (conversation_id, created_at, id) serves filter and
+    # order. brief=true skips bodies and metadata.
+    cols = [Message.id, Message.role, Message.created_at]
+    if not brief:
+        cols += [Message.content, Message.meta_info]
+    q = select(*cols).where(Message.conversation_id == conversation_id)
     with get_session() as s:
-        msgs = s.exec(select(Message).where(Message.conversation_id == conversation_id).order_by(Message.created_at)).all()
-        return [
-            {
-                "id": m.id,
-                "role": m.role,
-                "content": m.content,
-                "metadata": {"file_name": None} if not m.meta_info else {"file_name": m.meta_info}, # Simple adaptation
-                "created_at": m.created_at.isoformat()
-            } 
-            for m in msgs
-        ]
+        if cursor is not None:
+            q = q.where(messages_before(s, cursor))
+        q = q.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit + 1)
+        rows = s.exec(q).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = str(rows[-1].id)
+    rows.reverse()
+    if brief:
+        return [{"id": m.id, "role": m.role, "created_at": m.created_at.isoformat()} for m in rows]
+    return [
+        {
+            "id": m.id,
+            "role": m.role,
+            "content": m.content,
+            "metadata": _message_metadata(m.meta_info),
+            "created_at": m.created_at.isoformat()
+        } 
+        for m in rows
+    ]
 
 
 @router.patch("/conversations/{conversation_id}")
@@ -83,14 +175,15 @@ def send_message(
         m = Message(conversation_id=c.id, role="user", content=content)
         s.add(m)
         s.commit()
+        # Start KB retrieval now; /chat/stream will pick up the result
+        try:
+            start_prefetch(c.id, m.id, content)
+        except Exception as e:
+            print(f"Prefetch not started: {e}")
         return {"conversation_id": c.id, "message_id": m.id}
 
 
-@router.post("/stream")
-async def stream_chat(
-    user_id: int = Body(...),
-    conversation_id: int = Body(...),
-):
+def _prepare_stream(user_id: int, conversation_id: int):
     with get_session() as s:
         u = s.get(User, user_id)
         if u is None:
@@ -100,33 +193,67 @@ async def stream_chat(
             raise HTTPException(status_code=404, detail="conversation not found")
         
         last = s.exec(
-            select(Message).where(Message.conversation_id == conversation_id).order_by(Message.id.desc())
+            # Latest user message: a retried/reconnected stream must not answer the previous reply
+            select(Message).where(Message.conversation_id == conversation_id, Message.role == "user")
+            .order_by(Message.created_at.desc(), Message.id.desc())
         ).first()
         if last is None:
             raise HTTPException(status_code=400, detail="no user message")
         
-        agent = build_agent(u.api_base_url, u.api_key, mode=c.mode)
+        message_id, prompt = last.id, last.content
+        agent_args = (u.api_base_url, u.api_key, c.mode)
+    ctx = None
+    if HISTORY_ENABLED:
+        with stage("history_context"):
+            ctx = history.context(conversation_id, message_id)
+    return agent_args, message_id, prompt, ctx
+
+
+@router.post("/stream")
+async def stream_chat(
+    user_id: int = Body(...),
+    conversation_id: int = Body(...),
+    knowledge_filters: dict | None = Body(None),
+):
+    # DB lookups and a possible first-time agent build are blocking; keep them off the loop
+    with stage("prepare_stream"):
+        agent_args, message_id, prompt, history_ctx = await run_in_threadpool(_prepare_stream, user_id, conversation_id)
+    # Prefetched passages are unscoped, so they only apply to unfiltered requests
+    docs = None
+    if not knowledge_filters:
+        with stage("prefetch_wait"):
+            docs = await take_prefetch(conversation_id, message_id)
+    context_docs = docs_to_context(docs) if docs else None
+    # With prefetched passages injected, use the agent without the KB search tool,
+    # so the model can't make a blocking retrieval call before its first token
+    agent = await run_in_threadpool(get_agent, *agent_args, not context_docs)
 
     async def gen():
+        parts = []
+        references = None
         try:
-            # We must use a separate thread for the synchronous generator to avoid blocking the async loop
-            # However, sse_starlette and fastapi handle iterables well. 
-            # The issue might be that agent.run returns a sync generator.
-            
-            # Since stream_agent yields strings, we iterate over it.
-            # If agent.run is blocking, it might cause issues, but for now let's try direct iteration.
-            
-            # Capture the generator first
-            generator = stream_agent(agent, last.content, str(conversation_id))
-            
-            for chunk in generator:
-                # Ensure we are yielding valid JSON-serializable data
-                yield {"event": "message", "data": chunk}
-                
+            # astream_agent drives agent.arun, so awaiting the LLM never blocks the loop.
+            # On client disconnect sse_starlette cancels this generator, which
+            # closes the agent run and aborts the upstream request.
+            async for event in astream_agent(agent, prompt, str(conversation_id), knowledge_filters, context_docs, history_ctx):
+                data = event["data"]
+                if event["event"] == "references":
+                    references = data["references"]
+                else:
+                    parts.append(data["content"])
+                # Serialise explicitly; sse_starlette would send the dict's repr
+                yield {"event": event["event"], "data": json.dumps(data, ensure_ascii=False)}
+
             yield {"event": "end", "data": "[DONE]"}
         except Exception as e:
             print(f"Error during streaming: {e}")
             yield {"event": "error", "data": str(e)}
+        finally:
+            # Runs on completion, error and client disconnect alike; the write is queued, not awaited
+            if parts:
+                enqueue_message(conversation_id, "assistant", "".join(parts), {"references": references} if references else None)
+            if HISTORY_ENABLED:
+                # Turns that slid out of the window get summarised off the request path
+                history.schedule_fold(conversation_id, message_id, build_summarizer(agent))
 
     return EventSourceResponse(gen())
-
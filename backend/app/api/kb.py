@@ -0,0 +1,31 @@
+from fastapi import APIRouter, HTTPException, Body
+from ..core.db import get_session
+from ..db.models import User
+from ..agents.registry import get_kb
+from ..agents.kb_index import index_status, maintain_kb
+
+
+router = APIRouter(prefix="/kb", tags=["kb"])
+
+
+def _require_admin(user_id: int) -> None:
+    with get_session() as s:
+        u = s.get(User, user_id)
+        if u is None:
+            raise HTTPException(status_code=404, detail="user not found")
+        if u.role != "admin":
+            raise HTTPException(status_code=403, detail="admin only")
+
+
+@router.get("/status")
+def kb_status(user_id: int):
+    _require_admin(user_id)
+    return index_status(get_kb())
+
+
+@router.post("/optimize")
+def kb_optimize(user_id: int = Body(...), reindex: bool = Body(False)):
+    # Plain def: FastAPI runs it in the threadpool, so a cold get_kb() (model load)
+    # and long index builds never block the event loop
+    _require_admin(user_id)
+    return maintain_kb(get_kb(), reindex)
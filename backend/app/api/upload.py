@@ -1,29 +1,80 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi.concurrency import run_in_threadpool
 import shutil
 import os
-from ..core.config import UPLOADS_DIR
-from ..agents.river_agent import build_kb, ingest_uploads
+from ..core.config import UPLOADS_DIR, IMAGES_DIR
+from ..core.metrics import stage
+from ..agents.ingest_jobs import submit_ingest, get_job, file_lock
 
 router = APIRouter(prefix="/upload", tags=["upload"])
 
+
+def _save_upload(file: UploadFile, file_path) -> None:
+    with stage("upload_save"), open(file_path, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)
+
+
+def _save_pdf(file: UploadFile, file_path) -> None:
+    # Copy to a temp file first (a slow client must not hold the lock), then swap it
+    # in under the per-file lock so a running ingest job never sees a partial file
+    tmp_path = file_path.with_name(f".{file_path.name}.{os.getpid()}.{id(file)}.part")
+    try:
+        _save_upload(file, tmp_path)
+        with file_lock(file_path.name):
+            os.replace(tmp_path, file_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
 @router.post("/pdf")
 async def upload_pdf(user_id: int, file: UploadFile = File(...)):
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
-    
+
     os.makedirs(UPLOADS_DIR.as_posix(), exist_ok=True)
     file_path = UPLOADS_DIR / file.filename
-    
+
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        # Trigger ingestion
-        kb = build_kb()
-        result = ingest_uploads(kb)
-        
-        return {"filename": file.filename, "ingested": True, "details": result}
-        
+        # Disk write off the event loop; ingestion runs in the background job pool
+        await run_in_threadpool(_save_pdf, file, file_path)
+        job = submit_ingest(file.filename)
+
+        return {"filename": file.filename, "ingested": False, "job_id": job.id, "status": job.status}
+
     except Exception as e:
         print(f"Error uploading file: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.delete("/pdf/{filename}")
+def delete_pdf(filename: str, user_id: int):
+    if os.path.basename(filename) != filename or not filename.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="invalid file name")
+    file_path = UPLOADS_DIR / filename
+    with file_lock(filename):
+        if file_path.is_file():
+            file_path.unlink()
+    # The ingest job sees the file gone and drops its vectors and registry row
+    job = submit_ingest(filename)
+    return {"filename": filename, "job_id": job.id, "status": job.status}
+
+
+@router.post("/image")
+async def upload_image(user_id: int, file: UploadFile = File(...)):
+    if not (file.content_type or "").startswith("image/"):
+        raise HTTPException(status_code=400, detail="Only image files are supported")
+
+    os.makedirs(IMAGES_DIR.as_posix(), exist_ok=True)
+    file_path = IMAGES_DIR / os.path.basename(file.filename)
+    await run_in_threadpool(_save_upload, file, file_path)
+    # extract_water_body accepts this path (or just the file name)
+    return {"filename": file_path.name, "file_path": file_path.as_posix()}
+
+
+@router.get("/jobs/{job_id}")
+def get_ingest_job(job_id: str):
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return job.to_dict()
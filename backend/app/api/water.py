@@ -0,0 +1,35 @@
+import json
+from fastapi import APIRouter, Body, HTTPException
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from sse_starlette.sse import EventSourceResponse
+from ..tools.water import iter_batch, list_images
+from ..utils.water import WaterParams
+
+
+router = APIRouter(prefix="/water", tags=["water"])
+
+
+@router.post("/batch")
+async def water_batch(source: str = Body(...), params: dict | None = Body(None)):
+    try:
+        water_params = WaterParams(**(params or {}))
+    except TypeError as e:
+        raise HTTPException(status_code=400, detail=f"invalid params: {e}")
+    try:
+        # Fail fast (400) on an empty or oversized source instead of inside the stream
+        total = len(await run_in_threadpool(list_images, source))
+    except (FileNotFoundError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def gen():
+        yield {"event": "start", "data": json.dumps({"total": total})}
+        try:
+            # iter_batch blocks on hashing and the process pool; drive it from a worker thread
+            async for result in iterate_in_threadpool(iter_batch(source, water_params)):
+                yield {"event": "result", "data": json.dumps(result, ensure_ascii=False)}
+            yield {"event": "end", "data": "[DONE]"}
+        except Exception as e:
+            print(f"Error during water batch: {e}")
+            yield {"event": "error", "data": str(e)}
+
+    return EventSourceResponse(gen())
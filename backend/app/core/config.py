@@ -5,11 +5,18 @@ from dotenv import load_dotenv
 BASE_DIR = Path(__file__).resolve().parents[2]
 load_dotenv(BASE_DIR / ".env")
 
-DATA_DIR = BASE_DIR / "data"
+# DATA_DIR / MODELS_DIR can be pointed elsewhere (e.g. a scratch directory for benchmarks)
+DATA_DIR = Path(os.getenv("DATA_DIR", (BASE_DIR / "data").as_posix()))
 UPLOADS_DIR = DATA_DIR / "uploads"
 LANCEDB_DIR = DATA_DIR / "lancedb"
 DB_PATH = DATA_DIR / "riverai.sqlite"
 DB_URL = f"sqlite:///{DB_PATH.as_posix()}"
+DB_ASYNC_URL = f"sqlite+aiosqlite:///{DB_PATH.as_posix()}"
+MODELS_DIR = Path(os.getenv("MODELS_DIR", (DATA_DIR / "models").as_posix()))
+IMAGES_DIR = UPLOADS_DIR / "images"
+OUTPUTS_DIR = DATA_DIR / "outputs"
+# Base URL under which DATA_DIR is served (/files); used for links in tool results
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "http://localhost:8006")
 
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
 DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL")
@@ -17,4 +24,114 @@ DEEPSEEK_MODEL = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
 DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY")
 DASHSCOPE_MODEL = os.getenv("DASHSCOPE_MODEL", "qwen3-vl-32b-instruct")
 
+# Knowledge base / agent cache
+EMBED_MODEL_ID = os.getenv("EMBED_MODEL_ID", "BAAI/bge-small-zh-v1.5")
+EMBED_DIMENSIONS = int(os.getenv("EMBED_DIMENSIONS", "512"))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+# Persistent embedding cache for ingestion (0 disables it)
+EMBED_CACHE_PATH = DATA_DIR / "embed_cache.sqlite"
+EMBED_CACHE_MAX_MB = int(os.getenv("EMBED_CACHE_MAX_MB", "512"))
+# fastembed data-parallel workers: unset = single process, 0 = all cores
+EMBED_PARALLEL = int(os.environ["EMBED_PARALLEL"]) if os.getenv("EMBED_PARALLEL") else None
+AGENT_CACHE_SIZE = int(os.getenv("AGENT_CACHE_SIZE", "32"))
+# In-process query embedding / retrieval result caches (entries, seconds)
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "512"))
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", "600"))
+# Knowledge chunks, in bge tokens (the model's limit is 512 including special tokens)
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "256"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
 
+# LanceDB vector index / maintenance
+KB_INDEX_MIN_ROWS = int(os.getenv("KB_INDEX_MIN_ROWS", "5000"))  # brute force is fine below this
+KB_INDEX_TYPE = os.getenv("KB_INDEX_TYPE", "IVF_PQ")  # or IVF_HNSW_SQ
+KB_NPROBES = int(os.getenv("KB_NPROBES", "20"))
+KB_REINDEX_UNINDEXED_RATIO = float(os.getenv("KB_REINDEX_UNINDEXED_RATIO", "0.2"))
+KB_VERSION_RETENTION_MIN = int(os.getenv("KB_VERSION_RETENTION_MIN", "60"))
+# Hybrid retrieval: candidates taken from each of vector and FTS search, RRF constant
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+# Speculative retrieval started by /chat/send and picked up by /chat/stream
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "1") != "0"
+PREFETCH_RESULTS = int(os.getenv("PREFETCH_RESULTS", "5"))
+PREFETCH_TTL = float(os.getenv("PREFETCH_TTL", "60"))
+PREFETCH_WAIT = float(os.getenv("PREFETCH_WAIT", "3"))
+
+# Conversation history sent with each prompt: recent turns kept verbatim within a
+# token budget; older turns are folded into a rolling summary (SessionState)
+HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "1") != "0"
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "6"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "400"))
+
+# SQLite connection tuning (applied to every pooled connection)
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "WAL")
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "20000"))
+DB_MMAP_SIZE_MB = int(os.getenv("DB_MMAP_SIZE_MB", "128"))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Opt-in async engine (get_async_session, needs aiosqlite); no handler uses it yet,
+# so it isn't built unless DB_ASYNC=1
+DB_ASYNC = os.getenv("DB_ASYNC", "0") == "1"
+
+# Keyset pagination page sizes for conversation / message listings
+CONVERSATIONS_PAGE_SIZE = int(os.getenv("CONVERSATIONS_PAGE_SIZE", "50"))
+MESSAGES_PAGE_SIZE = int(os.getenv("MESSAGES_PAGE_SIZE", "100"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "500"))
+
+# Retention sweep: conversations idle longer than RETENTION_DAYS and SessionState rows
+# older than SESSION_STATE_RETENTION_DAYS are purged (0 disables), in small batches
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "0"))
+SESSION_STATE_RETENTION_DAYS = int(os.getenv("SESSION_STATE_RETENTION_DAYS", "0"))
+RETENTION_BATCH = int(os.getenv("RETENTION_BATCH", "200"))
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "3600"))
+
+# SSE streaming: tokens are coalesced into frames of at most STREAM_FRAME_MS / STREAM_FRAME_CHARS;
+# references are sent once per reply with snippets cut to REFERENCE_SNIPPET_CHARS
+STREAM_FRAME_MS = float(os.getenv("STREAM_FRAME_MS", "50"))
+STREAM_FRAME_CHARS = int(os.getenv("STREAM_FRAME_CHARS", "256"))
+REFERENCE_SNIPPET_CHARS = int(os.getenv("REFERENCE_SNIPPET_CHARS", "200"))
+
+# Write-behind queue for streamed assistant replies: max rows per commit, flush interval (s),
+# commit attempts per batch (backoff doubles from the base delay, s) before rows are written one by one
+WRITE_BEHIND_BATCH = int(os.getenv("WRITE_BEHIND_BATCH", "64"))
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "0.2"))
+WRITE_BEHIND_RETRIES = int(os.getenv("WRITE_BEHIND_RETRIES", "4"))
+WRITE_BEHIND_BACKOFF = float(os.getenv("WRITE_BEHIND_BACKOFF", "0.25"))
+
+# Water extraction: working-set budget per tile (float intermediates), largest decoded
+# image, and the longest side of the overlay PNG. The decoded image stays in memory
+# (3-4 bytes/px, more while PIL decodes), so peak RSS grows with WATER_MAX_PIXELS:
+# a 10k x 10k RGB PNG peaks around 550 MB. Larger JPEGs are decoded at reduced
+# size, other formats are rejected
+WATER_TILE_MB = int(os.getenv("WATER_TILE_MB", "64"))
+WATER_MAX_PIXELS = int(os.getenv("WATER_MAX_PIXELS", "100000000"))
+WATER_OVERLAY_MAX_SIDE = int(os.getenv("WATER_OVERLAY_MAX_SIDE", "2048"))
+# GeoJSON vectorisation: Douglas-Peucker tolerance and smallest polygon/hole kept
+# (both in source pixels), and the longest side the mask is traced at
+WATER_SIMPLIFY_TOLERANCE = float(os.getenv("WATER_SIMPLIFY_TOLERANCE", "1.5"))
+WATER_MIN_AREA_PX = float(os.getenv("WATER_MIN_AREA_PX", "64"))
+WATER_VECTOR_MAX_SIDE = int(os.getenv("WATER_VECTOR_MAX_SIDE", "4096"))
+# Batch extraction: worker processes, images per request, and the directories a
+# batch source may point into (os.pathsep-separated)
+WATER_WORKERS = int(os.getenv("WATER_WORKERS", str(min(4, os.cpu_count() or 1))))
+WATER_BATCH_MAX_IMAGES = int(os.getenv("WATER_BATCH_MAX_IMAGES", "1000"))
+WATER_BATCH_ROOTS = [Path(p) for p in os.getenv("WATER_BATCH_ROOTS", DATA_DIR.as_posix()).split(os.pathsep) if p]
+
+# Metrics: Prometheus text at /metrics, and optional per-request stage timings in a
+# Server-Timing response header
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+METRICS_TIMING_HEADERS = os.getenv("METRICS_TIMING_HEADERS", "0") != "0"
+
+# Background ingestion
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# PDF text extraction: processes used for page-range sharding (1 = serial)
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_SHARD_PAGES = int(os.getenv("PDF_SHARD_PAGES", "16"))
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", "200"))
+# Max chunks held (text + vectors) between extraction and the LanceDB insert
+INGEST_MAX_INFLIGHT = int(os.getenv("INGEST_MAX_INFLIGHT", "256"))
@@ -1,13 +1,201 @@
 from sqlmodel import SQLModel, create_engine, Session
-from .config import DB_URL, DATA_DIR
+from sqlalchemy import event, text
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+from .config import (
+    DB_URL, DB_ASYNC_URL, DATA_DIR, DB_JOURNAL_MODE, DB_SYNCHRONOUS, DB_BUSY_TIMEOUT_MS,
+    DB_CACHE_SIZE_KB, DB_MMAP_SIZE_MB, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_ASYNC,
+)
+from .metrics import Histogram
 from pathlib import Path
+import time
+
+try:
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlmodel.ext.asyncio.session import AsyncSession
+    import aiosqlite  # noqa: F401
+except ImportError:
+    create_async_engine = None
+
+
+def _set_sqlite_pragmas(dbapi_conn, _record) -> None:
+    # Per-connection settings; journal_mode=WAL is persistent but cheap to re-assert.
+    # WAL lets readers run alongside the single writer, busy_timeout makes writers
+    # wait for the lock instead of failing with "database is locked".
+    cur = dbapi_conn.cursor()
+    cur.execute(f"PRAGMA journal_mode={DB_JOURNAL_MODE}")
+    cur.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    cur.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    cur.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    cur.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE_MB * 1024 * 1024}")
+    cur.execute("PRAGMA temp_store=MEMORY")
+    cur.close()
+
+
+engine = create_engine(
+    DB_URL,
+    echo=False,
+    # Connections are handed between threadpool workers, so allow cross-thread use
+    connect_args={"check_same_thread": False, "timeout": DB_BUSY_TIMEOUT_MS / 1000},
+    poolclass=QueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+)
+event.listen(engine, "connect", _set_sqlite_pragmas)
+
+
+db_query_seconds = Histogram("riverai_db_query_seconds", "SQLite statement execution time.", ("op",))
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    started = conn.info["query_start"].pop()
+    # Statement verb only (SELECT/INSERT/...), so the label set stays small
+    db_query_seconds.observe(time.perf_counter() - started, op=(statement.split(None, 1) or ["?"])[0].upper())
+
+
+def _execute_failed(context) -> None:
+    # after_cursor_execute is skipped for failed statements; drop their start time
+    conn = context.connection
+    if conn is not None and conn.info.get("query_start"):
+        conn.info["query_start"].pop()
+
+
+event.listen(engine, "before_cursor_execute", _before_execute)
+event.listen(engine, "after_cursor_execute", _after_execute)
+event.listen(engine, "handle_error", _execute_failed)
+
+async_engine = None
+if DB_ASYNC and create_async_engine is not None:
+    async_engine = create_async_engine(DB_ASYNC_URL, echo=False, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "before_cursor_execute", _before_execute)
+    event.listen(async_engine.sync_engine, "after_cursor_execute", _after_execute)
+    event.listen(async_engine.sync_engine, "handle_error", _execute_failed)
+
+# One reusable Session per thread for long-lived workers (write-behind, ingestion)
+_thread_sessions = scoped_session(sessionmaker(bind=engine, class_=Session, expire_on_commit=False))
+
+# Columns added after the first release; create_all only creates missing tables,
+# so existing databases get them through ALTER TABLE in init_db.
+_ADDED_COLUMNS = {
+    "documentregistry": {
+        "file_hash": "VARCHAR",
+        "file_size": "INTEGER",
+        "file_mtime": "FLOAT",
+    },
+}
+_ADDED_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_documentregistry_file_hash ON documentregistry (file_hash)",
+    "CREATE INDEX IF NOT EXISTS ix_conversation_user_id_updated_at ON conversation (user_id, updated_at)",
+    # Messages are ordered by (created_at, id); replaces the earlier (conversation_id, id) index
+    "DROP INDEX IF EXISTS ix_message_conversation_id_id",
+    "CREATE INDEX IF NOT EXISTS ix_message_conversation_id_created_at_id ON message (conversation_id, created_at, id)",
+]
+
+
+# Full-text index over Message.content, partitioned by user: the rowid is
+# (conversation.user_id << 32) | message.id, so a search MATCHes only inside the
+# caller's rowid range instead of ranking every user's hits. Contentless (the text
+# stays in message only) and kept in sync by triggers; trigram tokens work for
+# Chinese, which has no spaces for a word tokenizer to split on.
+# Messages must be deleted before their conversation (delete_conversations does),
+# since the delete trigger looks up the owner.
+FTS_USER_SHIFT = 32
+_FTS_TABLE = "CREATE VIRTUAL TABLE message_search USING fts5(content, content='', tokenize='trigram')"
+_FTS_ROWID = f"(SELECT c.user_id FROM conversation c WHERE c.id = {{row}}.conversation_id) << {FTS_USER_SHIFT} | {{row}}.id"
+_FTS_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS message_search_ai AFTER INSERT ON message BEGIN
+        INSERT INTO message_search(rowid, content) VALUES ({_FTS_ROWID.format(row="new")}, new.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS message_search_ad AFTER DELETE ON message BEGIN
+        INSERT INTO message_search(message_search, rowid, content) VALUES ('delete', {_FTS_ROWID.format(row="old")}, old.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS message_search_au AFTER UPDATE OF content ON message BEGIN
+        INSERT INTO message_search(message_search, rowid, content) VALUES ('delete', {_FTS_ROWID.format(row="old")}, old.content);
+        INSERT INTO message_search(rowid, content) VALUES ({_FTS_ROWID.format(row="new")}, new.content);
+    END""",
+]
+# The earlier external-content index keyed by message id alone
+_OLD_FTS = [
+    "DROP TRIGGER IF EXISTS message_fts_ai",
+    "DROP TRIGGER IF EXISTS message_fts_ad",
+    "DROP TRIGGER IF EXISTS message_fts_au",
+    "DROP TABLE IF EXISTS message_fts",
+]
+
+
+def _ensure_message_fts(conn) -> None:
+    for ddl in _OLD_FTS:
+        conn.execute(text(ddl))
+    exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'message_search'")).first()
+    if exists is None:
+        try:
+            conn.execute(text(_FTS_TABLE))
+        except Exception as e:
+            # SQLite without FTS5/trigram (< 3.34): /chat/search falls back to LIKE
+            print(f"Message full-text index unavailable: {e}")
+            return
+        # Index messages written before the table existed
+        conn.execute(text(
+            "INSERT INTO message_search(rowid, content) "
+            f"SELECT c.user_id << {FTS_USER_SHIFT} | m.id, m.content FROM message m JOIN conversation c ON c.id = m.conversation_id"
+        ))
+    for ddl in _FTS_TRIGGERS:
+        conn.execute(text(ddl))
+
+
+def fts_available() -> bool:
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'message_search'")).first() is not None
+
+
+def _migrate() -> None:
+    with engine.begin() as conn:
+        for table, columns in _ADDED_COLUMNS.items():
+            existing = {row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))}
+            for name, ddl in columns.items():
+                if name not in existing:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+        for ddl in _ADDED_INDEXES:
+            conn.execute(text(ddl))
+    # Separate transaction: a failed CREATE VIRTUAL TABLE must not roll back the above
+    with engine.begin() as conn:
+        _ensure_message_fts(conn)
 
-engine = create_engine(DB_URL, echo=False)
 
 def init_db() -> None:
     Path(DATA_DIR).mkdir(parents=True, exist_ok=True)
     SQLModel.metadata.create_all(engine)
+    _migrate()
 
 def get_session() -> Session:
     return Session(engine)
 
+
+def thread_session() -> Session:
+    """The calling thread's Session. Closing it (e.g. `with thread_session() as s`)
+    releases its connection to the pool; the next call reuses the same object."""
+    return _thread_sessions()
+
+
+def get_async_session() -> "AsyncSession":
+    """AsyncSession on the aiosqlite engine, for async handlers."""
+    if async_engine is None:
+        raise RuntimeError("async database engine unavailable (set DB_ASYNC=1 and install aiosqlite)")
+    return AsyncSession(async_engine, expire_on_commit=False)
+
+
+def close_db() -> None:
+    # Let SQLite refresh planner statistics before the pool goes away
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("PRAGMA optimize"))
+    except Exception as e:
+        print(f"PRAGMA optimize failed: {e}")
+    _thread_sessions.remove()
+    engine.dispose()
@@ -1,5 +1,6 @@
 from typing import Optional, List
 from datetime import datetime
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field, Relationship
 
 
@@ -16,6 +17,9 @@ class User(SQLModel, table=True):
 
 
 class Conversation(SQLModel, table=True):
+    # Serves the per-user listing ordered by updated_at
+    __table_args__ = (Index("ix_conversation_user_id_updated_at", "user_id", "updated_at"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(index=True, foreign_key="user.id")
     title: str = Field(default="新对话")
@@ -28,6 +32,10 @@ class Conversation(SQLModel, table=True):
 
 
 class Message(SQLModel, table=True):
+    # Serves message pages within a conversation. Order is (created_at, id): write-behind
+    # replies get their id at commit time but their created_at when queued
+    __table_args__ = (Index("ix_message_conversation_id_created_at_id", "conversation_id", "created_at", "id"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     conversation_id: int = Field(index=True, foreign_key="conversation.id")
     role: str
@@ -49,6 +57,9 @@ class DocumentRegistry(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     filename: str = Field(index=True)
     file_path: str
+    file_hash: Optional[str] = Field(default=None, index=True)  # sha256 of the file content
+    file_size: Optional[int] = None
+    file_mtime: Optional[float] = None
     ingested: bool = Field(default=False)
     ingested_at: Optional[datetime] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
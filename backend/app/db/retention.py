@@ -0,0 +1,99 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+
+from sqlalchemy import delete
+from sqlmodel import Session, select
+
+from ..core.config import RETENTION_DAYS, SESSION_STATE_RETENTION_DAYS, RETENTION_BATCH, RETENTION_INTERVAL
+from ..core.db import get_session
+from .models import Conversation, Message, SessionState
+
+
+# SessionState namespaces keyed by conversation id (see ConversationHistory in agents/memory.py)
+CONVERSATION_STATE_NAMESPACES = ("history",)
+_IN_BATCH = 500
+# Pause between sweep batches so chat writes can take the lock in between
+_BATCH_PAUSE = 0.05
+
+
+def delete_conversations(s: Session, ids: Iterable[int]) -> int:
+    """Delete conversations with their messages and session state using set-based
+    DELETEs. The caller commits."""
+    ids = list(dict.fromkeys(ids))
+    deleted = 0
+    for i in range(0, len(ids), _IN_BATCH):
+        part = ids[i:i + _IN_BATCH]
+        keys = [f"{ns}:{cid}" for ns in CONVERSATION_STATE_NAMESPACES for cid in part]
+        s.exec(delete(Message).where(Message.conversation_id.in_(part)))
+        s.exec(delete(SessionState).where(SessionState.session_id.in_(keys)))
+        deleted += s.exec(delete(Conversation).where(Conversation.id.in_(part))).rowcount
+    return deleted
+
+
+def purge_conversations(older_than: datetime, batch: int = RETENTION_BATCH) -> int:
+    total = 0
+    while True:
+        # One short transaction per batch keeps each write-lock hold bounded
+        with get_session() as s:
+            ids: List[int] = s.exec(
+                select(Conversation.id).where(Conversation.updated_at < older_than).limit(batch)
+            ).all()
+            if not ids:
+                return total
+            total += delete_conversations(s, ids)
+            s.commit()
+        time.sleep(_BATCH_PAUSE)
+
+
+def purge_session_state(older_than: datetime, batch: int = RETENTION_BATCH) -> int:
+    total = 0
+    while True:
+        with get_session() as s:
+            ids = s.exec(select(SessionState.id).where(SessionState.updated_at < older_than).limit(batch)).all()
+            if not ids:
+                return total
+            total += s.exec(delete(SessionState).where(SessionState.id.in_(ids))).rowcount
+            s.commit()
+        time.sleep(_BATCH_PAUSE)
+
+
+def run_retention(now: Optional[datetime] = None) -> dict:
+    now = now or datetime.utcnow()
+    result = {"conversations": 0, "session_state": 0}
+    if RETENTION_DAYS > 0:
+        result["conversations"] = purge_conversations(now - timedelta(days=RETENTION_DAYS))
+    if SESSION_STATE_RETENTION_DAYS > 0:
+        result["session_state"] = purge_session_state(now - timedelta(days=SESSION_STATE_RETENTION_DAYS))
+    return result
+
+
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def _loop() -> None:
+    while not _stop.is_set():
+        try:
+            result = run_retention()
+            if any(result.values()):
+                print(f"Retention sweep purged {result}")
+        except Exception as e:
+            print(f"Retention sweep failed: {e}")
+        _stop.wait(RETENTION_INTERVAL)
+
+
+def start_retention() -> None:
+    global _thread
+    if RETENTION_DAYS <= 0 and SESSION_STATE_RETENTION_DAYS <= 0:
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, name="retention-sweep", daemon=True)
+    _thread.start()
+
+
+def stop_retention() -> None:
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout=5)
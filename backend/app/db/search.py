@@ -0,0 +1,117 @@
+import math
+import re
+from typing import Any, Dict, List
+
+from sqlalchemy import text
+
+from ..core.db import get_session, fts_available, FTS_USER_SHIFT
+
+
+# Trigram FTS can only match terms of three or more characters; shorter ones
+# (most two-character Chinese words) are checked with LIKE on the matched rows.
+_MIN_FTS_TERM = 3
+# Newest FTS hits ranked per query; bm25() in SQL would compute term statistics over
+# every user's postings, so the caller's candidates are scored here instead
+_FTS_CANDIDATES = 2000
+_BM25_K1, _BM25_B = 1.2, 0.75
+_fts = None
+
+
+def _use_fts() -> bool:
+    global _fts
+    if _fts is None:
+        _fts = fts_available()
+    return _fts
+
+
+def _like_pattern(term: str) -> str:
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _snippet(content: str, terms: List[str], width: int = 60) -> str:
+    # Excerpt centred on the first hit, every term occurrence wrapped in <mark>
+    lower = content.lower()
+    hits = [lower.find(t.lower()) for t in terms]
+    pos = min((h for h in hits if h >= 0), default=0)
+    start = max(pos - width // 2, 0)
+    out = content[start:start + width]
+    out = re.sub("|".join(re.escape(t) for t in sorted(terms, key=len, reverse=True)),
+                 lambda m: f"<mark>{m.group(0)}</mark>", out, flags=re.IGNORECASE)
+    return ("…" if start else "") + out + ("…" if start + width < len(content) else "")
+
+
+def _rank(rows, terms: List[str]) -> List[tuple]:
+    """BM25 over the candidate rows (term statistics from the candidates too)."""
+    lowered = [t.lower() for t in terms]
+    tfs = [[content.count(t) for t in lowered] for content in (r.content.lower() for r in rows)]
+    n = len(rows)
+    avg_len = sum(len(r.content) for r in rows) / n
+    idf = [math.log(1 + (n - df + 0.5) / (df + 0.5)) for df in (sum(1 for tf in tfs if tf[i]) for i in range(len(terms)))]
+    scored = []
+    for r, tf in zip(rows, tfs):
+        norm = _BM25_K1 * (1 - _BM25_B + _BM25_B * len(r.content) / avg_len)
+        score = sum(w * f * (_BM25_K1 + 1) / (f + norm) for w, f in zip(idf, tf))
+        scored.append((r, score))
+    scored.sort(key=lambda x: (x[1], x[0].created_at, x[0].id), reverse=True)
+    return scored
+
+
+def search_messages(user_id: int, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+    """Ranked message hits for one user's conversations: best BM25 first when
+    full-text search is possible, otherwise newest first."""
+    terms = [t for t in query.split() if t]
+    if not terms:
+        return []
+    long_terms = [t for t in terms if len(t) >= _MIN_FTS_TERM]
+    short_terms = [t for t in terms if len(t) < _MIN_FTS_TERM]
+    use_fts = bool(long_terms) and _use_fts()
+
+    params: Dict[str, Any] = {"user_id": user_id, "limit": limit}
+    like = []
+    for i, t in enumerate(short_terms if use_fts else terms):
+        params[f"like{i}"] = _like_pattern(t)
+        like.append(f"m.content LIKE :like{i} ESCAPE '\\'")
+
+    if use_fts:
+        # Quoted phrases, implicitly AND-ed; double quotes escape inside FTS strings.
+        # The rowid range holds only this user's messages (see core/db.py)
+        params["match"] = " ".join('"' + t.replace('"', '""') + '"' for t in long_terms)
+        params["lo"] = user_id << FTS_USER_SHIFT
+        params["hi"] = ((user_id + 1) << FTS_USER_SHIFT) - 1
+        sql = f"""
+            SELECT m.id, m.conversation_id, m.role, m.created_at, c.title, m.content
+            FROM message_search s
+            JOIN message m ON m.id = s.rowid & {(1 << FTS_USER_SHIFT) - 1}
+            JOIN conversation c ON c.id = m.conversation_id
+            WHERE message_search MATCH :match AND s.rowid BETWEEN :lo AND :hi
+            {"".join(" AND " + clause for clause in like)}
+            ORDER BY s.rowid DESC
+            LIMIT {_FTS_CANDIDATES}
+        """
+    else:
+        sql = f"""
+            SELECT m.id, m.conversation_id, m.role, m.created_at, c.title, m.content
+            FROM conversation c
+            JOIN message m ON m.conversation_id = c.id
+            WHERE c.user_id = :user_id AND {" AND ".join(like)}
+            ORDER BY m.created_at DESC, m.id DESC
+            LIMIT :limit
+        """
+
+    with get_session() as s:
+        rows = s.execute(text(sql), params).all()
+    scored = _rank(rows, terms)[:limit] if use_fts and rows else [(r, None) for r in rows]
+    return [
+        {
+            "message_id": r.id,
+            "conversation_id": r.conversation_id,
+            "conversation_title": r.title,
+            "role": r.role,
+            "snippet": _snippet(r.content, terms),
+            "score": round(score, 4) if score is not None else None,
+            # Raw SQL returns SQLite's "YYYY-MM-DD HH:MM:SS" text; match the ORM's isoformat
+            "created_at": str(r.created_at).replace(" ", "T", 1),
+        }
+        for r, score in scored
+    ]
@@ -0,0 +1,135 @@
+import json
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import and_, or_, update
+from sqlmodel import Session
+
+from ..core.config import WRITE_BEHIND_BATCH, WRITE_BEHIND_INTERVAL, WRITE_BEHIND_RETRIES, WRITE_BEHIND_BACKOFF
+from ..core.db import thread_session
+from .models import Conversation, Message
+
+
+# Streamed replies are handed to a single writer thread and committed in
+# batches, so the SSE path never waits on SQLite. created_at is taken at enqueue
+# time; readers order messages by (created_at, id), so a reply committed after a
+# quick follow-up message (with a higher id) still sorts before it.
+_queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+_thread: Optional[threading.Thread] = None
+_start_lock = threading.Lock()
+
+
+def _position(s: Session, message_id: int) -> Optional[datetime]:
+    m = s.get(Message, message_id)
+    return m.created_at if m is not None else None
+
+
+def messages_before(s: Session, message_id: int):
+    """WHERE clause for messages ordered before `message_id` by (created_at, id)."""
+    ts = _position(s, message_id)
+    if ts is None:
+        return Message.id < message_id
+    return or_(Message.created_at < ts, and_(Message.created_at == ts, Message.id < message_id))
+
+
+def messages_after(s: Session, message_id: int):
+    """WHERE clause for messages ordered after `message_id` by (created_at, id)."""
+    ts = _position(s, message_id)
+    if ts is None:
+        return Message.id > message_id
+    return or_(Message.created_at > ts, and_(Message.created_at == ts, Message.id > message_id))
+
+
+def _write(batch: List[Dict[str, Any]]) -> None:
+    latest: Dict[int, datetime] = {}
+    with thread_session() as s:
+        for item in batch:
+            s.add(Message(**item))
+            cid = item["conversation_id"]
+            latest[cid] = max(latest.get(cid, item["created_at"]), item["created_at"])
+        for cid, ts in latest.items():
+            s.exec(update(Conversation).where(Conversation.id == cid).values(updated_at=ts))
+        s.commit()
+
+
+def _persist(batch: List[Dict[str, Any]]) -> None:
+    # Transient failures (e.g. "database is locked") are retried with backoff
+    delay = WRITE_BEHIND_BACKOFF
+    for attempt in range(max(WRITE_BEHIND_RETRIES, 1)):
+        try:
+            _write(batch)
+            return
+        except Exception as e:
+            print(f"Write-behind: commit of {len(batch)} messages failed (attempt {attempt + 1}): {e}")
+            if attempt + 1 < WRITE_BEHIND_RETRIES:
+                time.sleep(delay)
+                delay *= 2
+    # Still failing: write row by row, so one bad row can't take the whole batch with it
+    for item in batch:
+        try:
+            _write([item])
+        except Exception as e:
+            print(f"Write-behind: dropped message for conversation {item['conversation_id']}: {e}")
+
+
+def _run() -> None:
+    stopping = False
+    while not stopping:
+        item = _queue.get()
+        if item is None:
+            break
+        batch = [item]
+        # Collect whatever else arrives within the flush window
+        while len(batch) < WRITE_BEHIND_BATCH:
+            try:
+                nxt = _queue.get(timeout=WRITE_BEHIND_INTERVAL)
+            except queue.Empty:
+                break
+            if nxt is None:
+                stopping = True
+                break
+            batch.append(nxt)
+        try:
+            _persist(batch)
+        finally:
+            for _ in batch:
+                _queue.task_done()
+    _queue.task_done()
+
+
+def _ensure_started() -> None:
+    global _thread
+    if _thread is None or not _thread.is_alive():
+        with _start_lock:
+            if _thread is None or not _thread.is_alive():
+                _thread = threading.Thread(target=_run, name="message-writer", daemon=True)
+                _thread.start()
+
+
+def enqueue_message(conversation_id: int, role: str, content: str, meta: Optional[Dict[str, Any]] = None) -> None:
+    """Queue a message for insertion; also bumps Conversation.updated_at."""
+    _ensure_started()
+    _queue.put({
+        "conversation_id": conversation_id,
+        "role": role,
+        "content": content,
+        "meta_info": json.dumps(meta, ensure_ascii=False, default=str) if meta else None,
+        "created_at": datetime.utcnow(),
+    })
+
+
+def flush_writes() -> None:
+    """Block until everything queued so far is committed."""
+    if _thread is not None and _thread.is_alive():
+        _queue.join()
+
+
+def shutdown_writer() -> None:
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        _queue.put(None)
+        _thread.join()
+    _thread = None
@@ -1,35 +1,275 @@
 from pathlib import Path
+import glob
+import hashlib
 import json
-from PIL import Image, ImageDraw
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Any, Dict, Iterator, List, Optional
 
+import numpy as np
 
-def extract_water_body(image_path: str) -> str:
+from ..core.config import (
+    DATA_DIR, IMAGES_DIR, OUTPUTS_DIR, PUBLIC_BASE_URL, WATER_WORKERS, WATER_BATCH_MAX_IMAGES, WATER_BATCH_ROOTS,
+    WATER_VECTOR_MAX_SIDE, WATER_OVERLAY_MAX_SIDE,
+)
+from ..utils.hashing import file_sha256
+from ..utils.pool import SpawnPool
+from ..utils.vectorize import mask_to_polygons, polygons_to_geojson
+from ..utils.water import WaterParams, open_image, render_overlay, sample_step, strided_masks
+
+
+def _allowed(path: Path) -> bool:
+    # Same rule as list_images: only files under DATA_DIR or WATER_BATCH_ROOTS,
+    # after resolving symlinks and ".." (paths come from the model / the user)
+    resolved = path.resolve()
+    return any(resolved.is_relative_to(r.resolve()) for r in [DATA_DIR, *WATER_BATCH_ROOTS])
+
+
+def _resolve_image(image_path: str) -> Path:
     p = Path(image_path)
-    out_dir = p.parent / "outputs"
+    # The agent often passes just the uploaded file name, or a path relative to the data dir
+    candidates = [p] if p.is_absolute() else []
+    candidates += [IMAGES_DIR / p.name, DATA_DIR / image_path.lstrip("/")]
+    for candidate in candidates:
+        if candidate.is_file() and _allowed(candidate):
+            return candidate.resolve()
+    raise FileNotFoundError(f"image not found: {image_path}")
+
+
+def _public_url(path: Path) -> Optional[str]:
+    try:
+        rel = path.resolve().relative_to(DATA_DIR.resolve())
+    except ValueError:
+        return None
+    return f"{PUBLIC_BASE_URL}/files/{rel.as_posix()}"
+
+
+def _mask_to_geojson(grid: np.ndarray, step: float, source: str, params: WaterParams) -> Dict[str, Any]:
+    # Large masks are traced on a strided grid (step source pixels per cell); the
+    # tolerance and minimum area are in source pixels either way
+    polygons = mask_to_polygons(
+        grid,
+        tolerance=params.simplify_tolerance / step,
+        min_area=params.min_area_px / (step * step),
+        scale=step,
+    )
+    return polygons_to_geojson(polygons, {"source": source, "class": "water", "crs": "pixel"})
+
+
+def _replace_into(path: Path, write) -> None:
+    # Write under a private name and rename, so concurrent runs never see partial files
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def run_extraction(
+    image_path: str, params: Optional[WaterParams] = None, out_dir: Optional[Path] = None, key: Optional[str] = None
+) -> Dict[str, Any]:
+    """Compute the water mask for one image and write <stem>_<key>_water.png / .geojson.
+
+    key (default: the batch cache key, a hash of content + params) keeps outputs of
+    same-named images from different folders apart in the shared outputs dir.
+    """
+    params = params or WaterParams()
+    src = _resolve_image(image_path)
+    key = key or _cache_key(src, params)
+    out_dir = out_dir or OUTPUTS_DIR
     out_dir.mkdir(parents=True, exist_ok=True)
-    png_path = out_dir / f"{p.stem}_water.png"
-    geojson_path = out_dir / f"{p.stem}_water.geojson"
-
-    img = Image.new("RGBA", (512, 512), (20, 20, 30, 255))
-    d = ImageDraw.Draw(img)
-    d.rectangle([50, 200, 460, 300], fill=(0, 160, 220, 200))
-    img.save(png_path.as_posix())
-
-    gj = {
-        "type": "FeatureCollection",
-        "features": [
-            {
-                "type": "Feature",
-                "properties": {"source": p.name},
-                "geometry": {
-                    "type": "Polygon",
-                    "coordinates": [[[50, 200], [460, 200], [460, 300], [50, 300], [50, 200]]],
-                },
-            }
-        ],
+    png_path = out_dir / f"{src.stem}_{key[:16]}_water.png"
+    geojson_path = out_dir / f"{src.stem}_{key[:16]}_water.geojson"
+
+    t0 = time.perf_counter()
+    img, scale = open_image(src.as_posix())
+    # Only the strided grids for the overlay and the tracer are kept, never the full mask
+    overlay_step = sample_step(img.width, img.height, WATER_OVERLAY_MAX_SIDE)
+    vector_step = sample_step(img.width, img.height, WATER_VECTOR_MAX_SIDE)
+    grids, water_fraction = strided_masks(img, params, (overlay_step, vector_step))
+    overlay = render_overlay(img, grids[overlay_step], overlay_step)
+    _replace_into(png_path, lambda p: overlay.save(p.as_posix(), format="PNG", optimize=False))
+    geojson = _mask_to_geojson(grids[vector_step], vector_step * scale, src.name, params)
+
+    def write_geojson(p: Path) -> None:
+        with open(p, "w", encoding="utf-8") as f:
+            json.dump(geojson, f, ensure_ascii=False, separators=(",", ":"))
+
+    _replace_into(geojson_path, write_geojson)
+
+    return {
+        "source": src.as_posix(),
+        "png": png_path.as_posix(),
+        "geojson": geojson_path.as_posix(),
+        "overlay_image": _public_url(png_path),
+        "geojson_url": _public_url(geojson_path),
+        "width": round(img.width * scale),
+        "height": round(img.height * scale),
+        "water_fraction": round(water_fraction, 4),
+        "elapsed_s": round(time.perf_counter() - t0, 3),
     }
-    with open(geojson_path, "w", encoding="utf-8") as f:
-        json.dump(gj, f, ensure_ascii=False)
 
-    return json.dumps({"png": png_path.as_posix(), "geojson": geojson_path.as_posix()})
 
+def extract_water_body(image_path: str) -> str:
+    """Extract water bodies (rivers, lakes, reservoirs) from an aerial or satellite image.
+
+    Args:
+        image_path: Path of the uploaded image, or its file name under uploads/images.
+
+    Returns:
+        JSON with the overlay PNG (overlay_image URL), the GeoJSON outline and the water fraction.
+    """
+    try:
+        return json.dumps(run_extraction(image_path), ensure_ascii=False)
+    except Exception as e:
+        return json.dumps({"error": str(e)}, ensure_ascii=False)
+
+
+# --- Batch extraction -------------------------------------------------------
+
+_IMAGE_EXTS = {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp"}
+BATCH_CACHE_DIR = OUTPUTS_DIR / "batch"
+
+_pool = SpawnPool()
+
+
+def shutdown_water_pool() -> None:
+    _pool.shutdown()
+
+
+def list_images(source: str) -> List[Path]:
+    """Images in a directory, matching a glob, or a single file; relative sources
+    are taken from uploads/images. Only files under WATER_BATCH_ROOTS are returned."""
+    p = Path(source)
+    if not p.is_absolute():
+        p = IMAGES_DIR / p
+    if p.is_dir():
+        files = [f for f in p.iterdir() if f.is_file()]
+    else:
+        files = [Path(f) for f in glob.glob(p.as_posix(), recursive=True)]
+    roots = [r.resolve() for r in WATER_BATCH_ROOTS]
+    images = sorted(
+        f for f in files
+        if f.suffix.lower() in _IMAGE_EXTS and f.is_file() and any(f.resolve().is_relative_to(r) for r in roots)
+    )
+    if not images:
+        raise FileNotFoundError(f"no images found for {source}")
+    if len(images) > WATER_BATCH_MAX_IMAGES:
+        raise ValueError(f"{len(images)} images exceed the batch limit of {WATER_BATCH_MAX_IMAGES}")
+    return images
+
+
+def _cache_key(path: Path, params: WaterParams) -> str:
+    h = hashlib.sha256(file_sha256(path.as_posix()).encode())
+    h.update(json.dumps(params.to_dict(), sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def _load_cached(key: str) -> Optional[Dict[str, Any]]:
+    meta = BATCH_CACHE_DIR / key / "result.json"
+    try:
+        with open(meta, encoding="utf-8") as f:
+            result = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not (Path(result["png"]).exists() and Path(result["geojson"]).exists()):
+        return None
+    return result
+
+
+def _extract_to_cache(image_path: str, params_dict: Dict[str, Any], key: str) -> Dict[str, Any]:
+    # Runs in a worker process
+    out_dir = BATCH_CACHE_DIR / key
+    result = run_extraction(image_path, WaterParams(**params_dict), out_dir, key)
+    result["cache_key"] = key
+    tmp = out_dir / f"result.json.{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False)
+    os.replace(tmp, out_dir / "result.json")
+    return result
+
+
+def iter_batch(source: str, params: Optional[WaterParams] = None, workers: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Run extraction over every image in `source`, yielding one result per image
+    as it finishes (cache hits first).
+
+    Results are cached in outputs/batch/<sha256(content + params)>, so repeated
+    runs over the same images return without recomputing. At most two images per
+    worker are in flight.
+    """
+    params = params or WaterParams()
+    workers = WATER_WORKERS if workers is None else max(workers, 1)
+    images = list_images(source)
+    total = len(images)
+
+    todo = deque()
+    for i, path in enumerate(images):
+        base = {"index": i, "total": total, "source": path.as_posix()}
+        try:
+            key = _cache_key(path, params)
+        except OSError as e:
+            yield {**base, "error": str(e)}
+            continue
+        cached = _load_cached(key)
+        if cached is not None:
+            yield {**cached, **base, "cached": True}
+        else:
+            todo.append((base, key))
+    if not todo:
+        return
+
+    if workers == 1 or len(todo) == 1:
+        for base, key in todo:
+            try:
+                yield {**_extract_to_cache(base["source"], params.to_dict(), key), **base, "cached": False}
+            except Exception as e:
+                yield {**base, "error": str(e)}
+        return
+
+    pool = _pool.get(workers)
+    inflight = {}
+    try:
+        while todo or inflight:
+            while todo and len(inflight) < workers * 2:
+                base, key = todo.popleft()
+                inflight[pool.submit(_extract_to_cache, base["source"], params.to_dict(), key)] = base
+            done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+            for fut in done:
+                base = inflight.pop(fut)
+                try:
+                    yield {**fut.result(), **base, "cached": False}
+                except Exception as e:
+                    yield {**base, "error": str(e)}
+    finally:
+        # Consumer went away (e.g. client disconnected): drop queued work
+        for fut in inflight:
+            fut.cancel()
+
+
+def extract_water_bodies(source: str) -> str:
+    """Extract water bodies from every image in a folder or glob pattern (batch version of extract_water_body).
+
+    Args:
+        source: A directory, a glob such as "segment_12/*.tif", or a single image; relative paths are under uploads/images.
+
+    Returns:
+        JSON with counts and, per image, the overlay_image URL, GeoJSON path and water fraction.
+    """
+    try:
+        results = list(iter_batch(source))
+    except Exception as e:
+        return json.dumps({"error": str(e)}, ensure_ascii=False)
+    keep = ("source", "overlay_image", "geojson", "water_fraction", "cached", "error")
+    return json.dumps(
+        {
+            "count": len(results),
+            "cached": sum(1 for r in results if r.get("cached")),
+            "failed": sum(1 for r in results if "error" in r),
+            "results": [{k: r[k] for k in keep if k in r} for r in sorted(results, key=lambda r: r["index"])],
+        },
+        ensure_ascii=False,
+    )
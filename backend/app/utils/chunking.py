@@ -0,0 +1,90 @@
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from ..core.config import MODELS_DIR, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS
+
+
+_tokenizer = None
+_tokenizer_loaded = False
+_tokenizer_lock = threading.Lock()
+
+
+def _find_tokenizer_json() -> Optional[str]:
+    # fastembed caches the model as models--Qdrant--bge-small-zh-v1.5/snapshots/<rev>/tokenizer.json
+    candidates = sorted(MODELS_DIR.glob("*bge-small-zh*/snapshots/*/tokenizer.json"))
+    return candidates[-1].as_posix() if candidates else None
+
+
+def get_tokenizer():
+    """The bundled bge-small-zh tokenizer, or None if it is not available."""
+    global _tokenizer, _tokenizer_loaded
+    if not _tokenizer_loaded:
+        with _tokenizer_lock:
+            if not _tokenizer_loaded:
+                path = _find_tokenizer_json()
+                try:
+                    from tokenizers import Tokenizer
+                except ImportError:
+                    Tokenizer = None
+                if path and Tokenizer is not None:
+                    tok = Tokenizer.from_file(path)
+                    tok.no_truncation()
+                    tok.no_padding()
+                    _tokenizer = tok
+                else:
+                    print("Warning: bge tokenizer not found, chunking by characters")
+                _tokenizer_loaded = True
+    return _tokenizer
+
+
+def count_tokens(text: str) -> int:
+    tok = get_tokenizer()
+    if tok is not None:
+        return len(tok.encode(text, add_special_tokens=False).ids)
+    return sum(1 for ch in text if not ch.isspace())
+
+
+def split_spans(text: str, max_tokens: int = CHUNK_MAX_TOKENS, overlap: int = CHUNK_OVERLAP_TOKENS) -> List[Tuple[int, int]]:
+    """Split text into (char_start, char_end) windows of at most max_tokens tokens,
+    consecutive windows sharing `overlap` tokens."""
+    max_tokens = max(max_tokens, 1)
+    step = max(max_tokens - max(overlap, 0), 1)
+
+    tok = get_tokenizer()
+    if tok is not None:
+        offsets = [o for o in tok.encode(text, add_special_tokens=False).offsets if o[1] > o[0]]
+    else:
+        # One "token" per non-space character is close enough for Chinese text
+        offsets = [(i, i + 1) for i, ch in enumerate(text) if not ch.isspace()]
+
+    if len(offsets) <= max_tokens:
+        return [(0, len(text))] if offsets else []
+
+    spans = []
+    n = len(offsets)
+    for i in range(0, n, step):
+        if i + max_tokens >= n:
+            # Slide the last window back to full size instead of emitting a tiny tail
+            i = max(n - max_tokens, 0)
+            spans.append((offsets[i][0], offsets[n - 1][1]))
+            break
+        spans.append((offsets[i][0], offsets[i + max_tokens - 1][1]))
+    return spans
+
+
+def chunk_pages(
+    pages: Iterable[Dict[str, Any]],
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    overlap: int = CHUNK_OVERLAP_TOKENS,
+) -> Iterator[Dict[str, Any]]:
+    """Split page dicts from load_pdf_chunks/iter_pdf_pages into token-bounded chunks.
+
+    Page metadata is kept; each chunk adds its index on the page and its
+    char offsets into the page text.
+    """
+    for page in pages:
+        text = page["text"]
+        for k, (start, end) in enumerate(split_spans(text, max_tokens, overlap)):
+            yield {
+                "text": text[start:end],
+                "metadata": {**page["metadata"], "chunk": k, "char_start": start, "char_end": end},
+            }
@@ -1,14 +1,24 @@
+from collections import deque
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import Iterator, List, Dict, Any
 from pypdf import PdfReader
+from ..core.config import PDF_WORKERS, PDF_SHARD_PAGES
+from .pool import SpawnPool
 
 
-def load_pdf_chunks(pdf_path: str) -> List[Dict[str, Any]]:
+_pool = SpawnPool()
+
+
+def shutdown_pdf_pool() -> None:
+    _pool.shutdown()
+
+
+def _extract_range(pdf_path: str, start: int, stop: int) -> List[Dict[str, Any]]:
     p = Path(pdf_path)
     reader = PdfReader(pdf_path)
     docs: List[Dict[str, Any]] = []
-    for i, page in enumerate(reader.pages):
-        text = page.extract_text() or ""
+    for i in range(start, min(stop, len(reader.pages))):
+        text = reader.pages[i].extract_text() or ""
         if not text.strip():
             continue
         docs.append(
@@ -19,3 +29,39 @@ def load_pdf_chunks(pdf_path: str) -> List[Dict[str, Any]]:
         )
     return docs
 
+
+def iter_pdf_pages(pdf_path: str, workers: int | None = None) -> Iterator[Dict[str, Any]]:
+    """Yield non-empty pages in page order.
+
+    With more than one worker, page ranges of PDF_SHARD_PAGES are extracted in
+    a shared process pool; at most two shards per worker are in flight.
+    """
+    workers = PDF_WORKERS if workers is None else workers
+    num_pages = len(PdfReader(pdf_path).pages)
+    shard = max(PDF_SHARD_PAGES, 1)
+
+    if workers <= 1 or num_pages <= shard:
+        yield from _extract_range(pdf_path, 0, num_pages)
+        return
+
+    pool = _pool.get(workers)
+    ranges = iter(range(0, num_pages, shard))
+    pending = deque()
+    try:
+        for start in ranges:
+            pending.append(pool.submit(_extract_range, pdf_path, start, start + shard))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            docs = pending.popleft().result()
+            start = next(ranges, None)
+            if start is not None:
+                pending.append(pool.submit(_extract_range, pdf_path, start, start + shard))
+            yield from docs
+    finally:
+        for fut in pending:
+            fut.cancel()
+
+
+def load_pdf_chunks(pdf_path: str, workers: int | None = None) -> List[Dict[str, Any]]:
+    return list(iter_pdf_pages(pdf_path, workers=workers))
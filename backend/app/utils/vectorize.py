@@ -0,0 +1,205 @@
+import math
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+
+# Directions in image coordinates (x right, y down); rings keep water on their right
+_RIGHT, _DOWN, _LEFT, _UP = 0, 1, 2, 3
+
+
+def _runs(edges: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Maximal runs of True along the last axis: (row, start, stop) arrays."""
+    padded = np.zeros((edges.shape[0], edges.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = edges
+    diff = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(diff == 1)
+    _, stops = np.nonzero(diff == -1)
+    return rows, starts, stops
+
+
+def _boundary_segments(mask: np.ndarray):
+    """Pixel-edge boundary of the mask as maximal straight segments.
+
+    Returns (x0, y0, x1, y1, direction) arrays; vertices are pixel corners.
+    """
+    h, w = mask.shape
+    m = np.zeros((h + 2, w + 2), dtype=bool)
+    m[1:-1, 1:-1] = mask
+    segs = []
+
+    # Horizontal grid lines y = 0..h, between pixel rows y-1 (above) and y (below)
+    above, below = m[:-1, 1:-1], m[1:, 1:-1]
+    rows, s, e = _runs(below & ~above)          # top edges of water: walk right
+    segs.append((s, rows, e, rows, np.full(rows.shape, _RIGHT)))
+    rows, s, e = _runs(above & ~below)          # bottom edges: walk left
+    segs.append((e, rows, s, rows, np.full(rows.shape, _LEFT)))
+
+    # Vertical grid lines x = 0..w, between pixel columns x-1 (left) and x (right)
+    left, right = m[1:-1, :-1].T, m[1:-1, 1:].T
+    cols, s, e = _runs(right & ~left)           # left edges of water: walk up
+    segs.append((cols, e, cols, s, np.full(cols.shape, _UP)))
+    cols, s, e = _runs(left & ~right)           # right edges: walk down
+    segs.append((cols, s, cols, e, np.full(cols.shape, _DOWN)))
+
+    return [np.concatenate(parts).astype(np.int64) for parts in zip(*segs)]
+
+
+def trace_rings(mask: np.ndarray) -> List[np.ndarray]:
+    """Closed boundary rings of a boolean mask as (n, 2) vertex arrays (not repeated at the end).
+
+    Outer boundaries have positive shoelace area in image coordinates, holes negative.
+    At diagonal (checkerboard) corners the walk turns right, so diagonally touching
+    pixels form separate polygons.
+    """
+    x0, y0, x1, y1, d = _boundary_segments(mask)
+    n = len(d)
+    if n == 0:
+        return []
+    stride = mask.shape[1] + 1
+    start_key = y0 * stride + x0
+    end_key = y1 * stride + x1
+
+    order = np.argsort(start_key, kind="stable")
+    sorted_keys = start_key[order]
+    first = np.searchsorted(sorted_keys, end_key, side="left")
+    count = np.searchsorted(sorted_keys, end_key, side="right") - first
+    nxt = order[np.minimum(first, n - 1)]
+    # Two segments leave a checkerboard corner; take the one turning right
+    ambiguous = np.flatnonzero(count == 2)
+    if len(ambiguous):
+        alt = order[first[ambiguous] + 1]
+        want = (d[ambiguous] + 1) % 4
+        nxt[ambiguous] = np.where(d[nxt[ambiguous]] == want, nxt[ambiguous], alt)
+
+    nxt_list = nxt.tolist()
+    seen = bytearray(n)
+    rings = []
+    for i in range(n):
+        if seen[i]:
+            continue
+        idx = []
+        j = i
+        while not seen[j]:
+            seen[j] = 1
+            idx.append(j)
+            j = nxt_list[j]
+        rings.append(np.stack([x0[idx], y0[idx]], axis=1))
+    return rings
+
+
+def ring_area(ring: np.ndarray) -> float:
+    x, y = ring[:, 0].astype(np.float64), ring[:, 1].astype(np.float64)
+    return 0.5 * float(np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y))
+
+
+def _dp(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """Douglas-Peucker on an open polyline; iterative, distances computed per span with NumPy."""
+    n = len(points)
+    if n <= 2:
+        return points
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    pts = points.astype(np.float64)
+    stack = [(0, n - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        seg = pts[b] - pts[a]
+        rel = pts[a + 1:b] - pts[a]
+        norm = math.hypot(seg[0], seg[1])
+        if norm == 0:
+            dist = np.hypot(rel[:, 0], rel[:, 1])
+        else:
+            dist = np.abs(seg[0] * rel[:, 1] - seg[1] * rel[:, 0]) / norm
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance:
+            m = a + 1 + k
+            keep[m] = True
+            stack.append((a, m))
+            stack.append((m, b))
+    return points[keep]
+
+
+def simplify_ring(ring: np.ndarray, tolerance: float) -> np.ndarray:
+    """Douglas-Peucker for a closed ring, split at the vertex farthest from the first."""
+    if tolerance <= 0 or len(ring) <= 4:
+        return ring
+    far = int(np.argmax(np.hypot(*(ring - ring[0]).T)))
+    if far == 0:
+        return ring[:1]
+    first = _dp(ring[: far + 1], tolerance)
+    second = _dp(np.vstack([ring[far:], ring[:1]]), tolerance)
+    return np.vstack([first[:-1], second[:-1]])
+
+
+def _contains(ring: np.ndarray, x: float, y: float) -> bool:
+    # Even-odd ray casting
+    xs, ys = ring[:, 0].astype(np.float64), ring[:, 1].astype(np.float64)
+    xn, yn = np.roll(xs, -1), np.roll(ys, -1)
+    crosses = (ys > y) != (yn > y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        xi = xs + (y - ys) * (xn - xs) / (yn - ys)
+    return bool(np.count_nonzero(crosses & (x < xi)) % 2)
+
+
+def mask_to_polygons(mask: np.ndarray, tolerance: float = 1.0, min_area: float = 0.0, scale: float = 1.0) -> List[Dict[str, Any]]:
+    """Vectorise a water mask into polygons with holes.
+
+    Rings smaller than min_area (pixels, before simplification) are dropped; the
+    rest are simplified with Douglas-Peucker at `tolerance` pixels. Coordinates
+    are multiplied by `scale` (for masks traced at reduced resolution). Returns
+    [{"exterior": ring, "holes": [ring, ...], "area": px}], rings as (n, 2) arrays.
+    """
+    outers, holes = [], []
+    for ring in trace_rings(mask):
+        area = ring_area(ring)
+        if abs(area) < min_area:
+            continue
+        (outers if area > 0 else holes).append((ring, area))
+
+    polys = [{"exterior": ring, "holes": [], "area": area} for ring, area in outers]
+    if holes and polys:
+        bboxes = np.array([[r[:, 0].min(), r[:, 1].min(), r[:, 0].max(), r[:, 1].max()] for r, _ in outers])
+        by_area = np.argsort([a for _, a in outers])
+        for ring, area in holes:
+            # The segment leaving ring[0] has water on its right; test that pixel's centre
+            (x, y), (x2, y2) = ring[0], ring[1]
+            dx, dy = np.sign(x2 - x), np.sign(y2 - y)
+            px, py = x + 0.5 * dx - 0.5 * dy, y + 0.5 * dy + 0.5 * dx
+            inside = (bboxes[:, 0] <= px) & (px <= bboxes[:, 2]) & (bboxes[:, 1] <= py) & (py <= bboxes[:, 3])
+            for i in by_area:
+                if inside[i] and _contains(outers[i][0], px, py):
+                    polys[i]["holes"].append(ring)
+                    polys[i]["area"] += area
+                    break
+
+    out = []
+    for p in polys:
+        exterior = simplify_ring(p["exterior"], tolerance)
+        if len(exterior) < 3:
+            continue
+        kept = [h for h in (simplify_ring(h, tolerance) for h in p["holes"]) if len(h) >= 3]
+        out.append({
+            "exterior": exterior * scale,
+            "holes": [h * scale for h in kept],
+            "area": p["area"] * scale * scale,
+        })
+    return out
+
+
+def _closed(ring: np.ndarray) -> List[List[float]]:
+    pts = ring.tolist()
+    return pts + [pts[0]]
+
+
+def polygons_to_geojson(polygons: List[Dict[str, Any]], properties: Dict[str, Any]) -> Dict[str, Any]:
+    features = []
+    for i, p in enumerate(polygons):
+        features.append({
+            "type": "Feature",
+            "properties": {**properties, "id": i, "area_px": round(p["area"], 1)},
+            "geometry": {"type": "Polygon", "coordinates": [_closed(p["exterior"])] + [_closed(h) for h in p["holes"]]},
+        })
+    return {"type": "FeatureCollection", "features": features}
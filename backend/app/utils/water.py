@@ -0,0 +1,211 @@
+import math
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from ..core.config import (
+    WATER_TILE_MB, WATER_MAX_PIXELS, WATER_SIMPLIFY_TOLERANCE, WATER_MIN_AREA_PX,
+)
+
+
+# Survey mosaics are legitimately larger than PIL's decompression-bomb default;
+# open_image enforces WATER_MAX_PIXELS itself (PIL only warns below 2x its limit)
+Image.MAX_IMAGE_PIXELS = 2 * WATER_MAX_PIXELS
+
+# Rough bytes per pixel held while classifying one tile (uint8 slice, float32
+# bands and HSV/index intermediates, bool masks)
+_BYTES_PER_PX = 48
+_WATER_RGB = np.array([0, 160, 220], dtype=np.float32)
+
+
+@dataclass(frozen=True)
+class WaterParams:
+    """Thresholds for the water mask.
+
+    A pixel is water when its hue lies in [hue_min, hue_max] degrees with at least
+    sat_min saturation and brightness within [val_min, val_max], and its blue
+    index (B - R) / (B + R) is at least index_min. With dark_water, very dark
+    pixels (deep or shaded water) count too. If nir_band names a near-infrared
+    band (4-band imagery), NDWI = (G - NIR) / (G + NIR) >= ndwi_min is used instead.
+    Opening then closing with the given radii removes speckle and fills small gaps.
+    The GeoJSON outline is simplified to simplify_tolerance pixels, and polygons or
+    holes under min_area_px pixels are dropped.
+    """
+
+    hue_min: float = 170.0
+    hue_max: float = 250.0
+    sat_min: float = 0.10
+    val_min: float = 0.05
+    val_max: float = 0.95
+    index_min: float = 0.03
+    dark_water: bool = False
+    dark_val_max: float = 0.15
+    nir_band: Optional[int] = None
+    ndwi_min: float = 0.0
+    open_radius: int = 1
+    close_radius: int = 2
+    simplify_tolerance: float = WATER_SIMPLIFY_TOLERANCE
+    min_area_px: float = WATER_MIN_AREA_PX
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def classify(pixels: np.ndarray, params: WaterParams) -> np.ndarray:
+    """Water mask for an (h, w, bands) uint8 array, without morphology."""
+    px = pixels.astype(np.float32)
+    px *= 1.0 / 255.0
+    r, g, b = px[..., 0], px[..., 1], px[..., 2]
+    eps = 1e-6
+
+    if params.nir_band is not None and pixels.shape[-1] > params.nir_band:
+        nir = px[..., params.nir_band]
+        return (g - nir) / (g + nir + eps) >= params.ndwi_min
+
+    vmax = np.maximum(np.maximum(r, g), b)
+    vmin = np.minimum(np.minimum(r, g), b)
+    delta = vmax - vmin
+    sat = delta / (vmax + eps)
+
+    # Standard HSV hue in degrees, vectorised over the tile
+    safe = delta + eps
+    hue = np.where(
+        vmax == r,
+        60.0 * ((g - b) / safe % 6.0),
+        np.where(vmax == g, 60.0 * ((b - r) / safe + 2.0), 60.0 * ((r - g) / safe + 4.0)),
+    )
+    bwi = (b - r) / (b + r + eps)
+
+    mask = (
+        (hue >= params.hue_min) & (hue <= params.hue_max)
+        & (sat >= params.sat_min)
+        & (vmax >= params.val_min) & (vmax <= params.val_max)
+        & (bwi >= params.index_min)
+    )
+    if params.dark_water:
+        mask |= vmax <= params.dark_val_max
+    return mask
+
+
+def _sliding(mask: np.ndarray, radius: int, axis: int, op) -> np.ndarray:
+    # 1-D max/min filter of width 2r+1 as an OR/AND over shifted views; edges replicate
+    if radius <= 0:
+        return mask
+    n = mask.shape[axis]
+    pad = [(0, 0)] * mask.ndim
+    pad[axis] = (radius, radius)
+    padded = np.pad(mask, pad, mode="edge")
+
+    def window(k):
+        index = [slice(None)] * mask.ndim
+        index[axis] = slice(k, k + n)
+        return padded[tuple(index)]
+
+    out = window(0).copy()
+    for k in range(1, 2 * radius + 1):
+        op(out, window(k), out=out)
+    return out
+
+
+def dilate(mask: np.ndarray, radius: int) -> np.ndarray:
+    return _sliding(_sliding(mask, radius, 0, np.logical_or), radius, 1, np.logical_or)
+
+
+def erode(mask: np.ndarray, radius: int) -> np.ndarray:
+    return _sliding(_sliding(mask, radius, 0, np.logical_and), radius, 1, np.logical_and)
+
+
+def clean_mask(mask: np.ndarray, open_radius: int, close_radius: int) -> np.ndarray:
+    if open_radius > 0:
+        mask = dilate(erode(mask, open_radius), open_radius)
+    if close_radius > 0:
+        mask = erode(dilate(mask, close_radius), close_radius)
+    return mask
+
+
+def _bands(height: int, width: int, halo: int, tile_mb: int) -> Iterator[Tuple[int, int, int, int]]:
+    """Full-width row bands (start, stop, read_start, read_stop) sized to the memory budget."""
+    rows = max((tile_mb * 1024 * 1024) // (max(width, 1) * _BYTES_PER_PX) - 2 * halo, 16)
+    for y0 in range(0, height, rows):
+        y1 = min(y0 + rows, height)
+        yield y0, y1, max(y0 - halo, 0), min(y1 + halo, height)
+
+
+def sample_step(width: int, height: int, max_side: int) -> int:
+    """Stride that brings the longest side down to max_side."""
+    return max(1, math.ceil(max(width, height) / max(max_side, 1)))
+
+
+def strided_masks(
+    img: Image.Image, params: WaterParams, steps: Sequence[int], tile_mb: int = WATER_TILE_MB
+) -> Tuple[Dict[int, np.ndarray], float]:
+    """Water mask sampled every `step` pixels (one grid per step), plus the water fraction.
+
+    The mask is computed band by band and each band is written straight into
+    the grids, so the full-resolution mask never exists; only one band's float
+    intermediates are alive at a time. Each band is read with a halo of
+    2 * (open_radius + close_radius) rows so morphology is seamless across
+    band borders.
+    """
+    width, height = img.size
+    halo = 2 * (params.open_radius + params.close_radius)
+    grids = {s: np.zeros((math.ceil(height / s), math.ceil(width / s)), dtype=bool) for s in set(steps)}
+    water = 0
+    for y0, y1, r0, r1 in _bands(height, width, halo, tile_mb):
+        pixels = np.asarray(img.crop((0, r0, width, r1)))
+        if pixels.ndim == 2:
+            pixels = np.repeat(pixels[..., None], 3, axis=2)
+        band = clean_mask(classify(pixels, params), params.open_radius, params.close_radius)[y0 - r0:y1 - r0]
+        del pixels
+        water += int(np.count_nonzero(band))
+        for s, grid in grids.items():
+            # First row of this band on the grid's stride
+            first = -(-y0 // s) * s
+            if first < y1:
+                grid[first // s:first // s + len(range(first, y1, s))] = band[first - y0::s, ::s]
+    return grids, (water / (width * height) if width * height else 0.0)
+
+
+def open_image(path: str, max_pixels: int = WATER_MAX_PIXELS) -> Tuple[Image.Image, float]:
+    """Decoded image and its scale (source pixels per decoded pixel).
+
+    The decoded image is held in memory (3-4 bytes per pixel), so its size is
+    capped at max_pixels: larger JPEGs are decoded at 1/2, 1/4 or 1/8 size via
+    draft(), anything else is rejected before decoding.
+    """
+    img = Image.open(path)
+    width, height = img.size
+    scale = 1.0
+    if width * height > max_pixels:
+        if img.format == "JPEG":
+            factor = 2
+            while factor < 8 and math.ceil(width / factor) * math.ceil(height / factor) > max_pixels:
+                factor *= 2
+            # draft picks the largest reduction that keeps at least the requested size
+            img.draft(img.mode, (max(width // factor, 1), max(height // factor, 1)))
+            scale = width / img.size[0]
+        if img.size[0] * img.size[1] > max_pixels:
+            raise ValueError(
+                f"image is {width}x{height} pixels; the limit is {max_pixels} (WATER_MAX_PIXELS)"
+            )
+    # Keep 8-bit RGB (plus a 4th band for RGBN imagery); palette/16-bit/etc. are converted
+    if img.mode not in ("RGB", "RGBA", "L"):
+        img = img.convert("RGB")
+    img.load()
+    return img, scale
+
+
+def render_overlay(img: Image.Image, m: np.ndarray, step: int, alpha: float = 0.5) -> Image.Image:
+    """Downscaled RGB preview with water tinted; `m` is the mask sampled every
+    `step` pixels (see sample_step / strided_masks)."""
+    # Reduce before converting so a full-resolution RGB copy is never made
+    small = img.reduce(step) if step > 1 else img
+    if small.mode != "RGB":
+        small = small.convert("RGB")
+    base = np.array(small, dtype=np.float32)
+    h, w = min(base.shape[0], m.shape[0]), min(base.shape[1], m.shape[1])
+    base, m = base[:h, :w], m[:h, :w]
+    base[m] = base[m] * (1 - alpha) + _WATER_RGB * alpha
+    return Image.fromarray(base.astype(np.uint8), "RGB")
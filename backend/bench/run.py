@@ -0,0 +1,431 @@
+"""Offline load test for the backend.
+
+Starts the stub LLM (backend/bench/stub_llm.py) and the FastAPI app in
+subprocesses against a scratch DATA_DIR, then runs concurrent chat sessions
+(/chat/send + /chat/stream) alongside PDF ingestions (/upload/pdf) and reports
+throughput, TTFT and end-to-end latency percentiles, ingestion pages/s and the
+server's peak RSS (the uvicorn process plus its PDF / water worker processes).
+Nothing leaves the machine: the LLM is the stub and HF_HUB_OFFLINE=1 is set, so
+the bge-small-zh ONNX weights must already be in MODELS_DIR (the repo ships only
+the tokenizer files). Fetch them once while online with
+
+    python -c "from fastembed import TextEmbedding; TextEmbedding('BAAI/bge-small-zh-v1.5', cache_dir='backend/data/models')"
+
+The bench checks for them before starting anything.
+
+Run from the repository root:
+
+    python -m backend.bench.run --sessions 50 --concurrency 8 --uploads 4
+    python -m backend.bench.run --json bench.json                      # keep results
+    python -m backend.bench.run --compare bench.json --tolerance 0.2   # fail on regressions
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+BACKEND_DIR = REPO_ROOT / "backend"
+DEFAULT_MODELS_DIR = BACKEND_DIR / "data" / "models"
+DEFAULT_PDF_DIR = BACKEND_DIR / "data" / "uploads"
+
+QUESTIONS = [
+    "河湖水域岸线空间管控的总体要求是什么？",
+    "岸线保护区和保留区有什么区别？",
+    "如何划定河湖管理范围？",
+    "What does the guideline say about shoreline utilisation?",
+    "违法占用岸线的问题应该如何清理整治？",
+]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(values: List[float], p: float) -> Optional[float]:
+    # Nearest-rank; None when there is nothing to rank
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))
+    return ordered[k]
+
+
+def _summary(values: List[float]) -> Dict[str, Optional[float]]:
+    return {
+        "p50": _round(_percentile(values, 50)),
+        "p95": _round(_percentile(values, 95)),
+        "p99": _round(_percentile(values, 99)),
+        "max": _round(max(values) if values else None),
+    }
+
+
+def _round(v: Optional[float], digits: int = 4) -> Optional[float]:
+    return round(v, digits) if v is not None else None
+
+
+def _peak_rss_mb(pid: int) -> Optional[float]:
+    # VmHWM is the resident-set high-water mark (Linux only)
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def _descendants(pid: int) -> List[int]:
+    # Children of every thread (Linux only); the worker pools are spawned from threads
+    found: List[int] = []
+    for children in Path(f"/proc/{pid}/task").glob("*/children"):
+        try:
+            kids = [int(c) for c in children.read_text().split()]
+        except (OSError, ValueError):
+            continue
+        for kid in kids:
+            if kid not in found:
+                found.append(kid)
+                found.extend(k for k in _descendants(kid) if k not in found)
+    return found
+
+
+def _process_tree_rss(pid: int) -> Dict[str, Any]:
+    """Peak RSS of the server process alone and summed with its live child processes.
+
+    The sum adds per-process peaks that need not coincide, so it is an upper
+    bound on the tree's simultaneous peak. Children that already exited are not counted."""
+    parent = _peak_rss_mb(pid)
+    children = [rss for rss in (_peak_rss_mb(c) for c in _descendants(pid)) if rss is not None]
+    total = round((parent or 0) + sum(children), 1) if parent is not None else None
+    return {"peak_rss_mb": total, "peak_rss_parent_mb": parent, "child_processes": len(children)}
+
+
+def _has_onnx_model(models_dir: Path) -> bool:
+    return any(models_dir.rglob("*.onnx"))
+
+
+class Server:
+    """A subprocess serving HTTP, with its output captured to a log file."""
+
+    def __init__(self, name: str, args: List[str], env: Dict[str, str], log_dir: Path, ready_path: str):
+        self.name = name
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.log_path = log_dir / f"{name}.log"
+        self._log = open(self.log_path, "wb")
+        cmd = [sys.executable, *[a.replace("{port}", str(self.port)) for a in args]]
+        self.proc = subprocess.Popen(cmd, cwd=REPO_ROOT, env=env, stdout=self._log, stderr=subprocess.STDOUT)
+        self.ready_path = ready_path
+
+    def wait_ready(self, timeout: float) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"{self.name} exited with {self.proc.returncode}; see {self.log_path}")
+            try:
+                if httpx.get(self.url + self.ready_path, timeout=1).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f"{self.name} not ready after {timeout}s; see {self.log_path}")
+
+    def stop(self) -> None:
+        if self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+        self._log.close()
+
+    def tail(self, lines: int = 20) -> str:
+        try:
+            return "\n".join(self.log_path.read_text(encoding="utf-8", errors="replace").splitlines()[-lines:])
+        except OSError:
+            return ""
+
+
+async def _chat_session(client: httpx.AsyncClient, user_id: int, question: str, timeout: float) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    r = await client.post("/chat/send", json={"user_id": user_id, "content": question})
+    r.raise_for_status()
+    conversation_id = r.json()["conversation_id"]
+
+    t_stream = time.perf_counter()
+    ttft = None
+    chars = 0
+    event = None
+    async with client.stream(
+        "POST", "/chat/stream", json={"user_id": user_id, "conversation_id": conversation_id}, timeout=timeout
+    ) as resp:
+        resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            if line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith("data:") and event == "message":
+                if ttft is None:
+                    ttft = time.perf_counter() - t_stream
+                chars += len(json.loads(line[5:].strip()).get("content", ""))
+            elif line.startswith("data:") and event == "error":
+                raise RuntimeError(line[5:].strip())
+            elif event == "end":
+                break
+    return {"ttft": ttft, "e2e": time.perf_counter() - t0, "chars": chars}
+
+
+async def _ingest(client: httpx.AsyncClient, user_id: int, name: str, content: bytes, timeout: float) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    r = await client.post(
+        "/upload/pdf", params={"user_id": user_id}, files={"file": (name, content, "application/pdf")}
+    )
+    r.raise_for_status()
+    job_id = r.json()["job_id"]
+    deadline = t0 + timeout
+    while time.perf_counter() < deadline:
+        job = (await client.get(f"/upload/jobs/{job_id}")).json()
+        if job["status"] in ("done", "failed"):
+            return {**job, "wall_s": time.perf_counter() - t0}
+        await asyncio.sleep(0.2)
+    raise TimeoutError(f"ingest job {job_id} still running after {timeout}s")
+
+
+async def _run_load(base_url: str, args, pdf: Optional[Path]) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=args.concurrency + args.uploads + 4)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        r = await client.post("/auth/login", json={"username": "admin", "password": "admin123"})
+        r.raise_for_status()
+        user_id = r.json()["user"]["id"]
+
+        # First turn loads the embedding model and builds the agent; report it separately
+        cold = await _chat_session(client, user_id, QUESTIONS[0], args.timeout)
+
+        sem = asyncio.Semaphore(args.concurrency)
+        chats: List[Dict[str, Any]] = []
+        errors: List[str] = []
+
+        async def one_chat(i: int) -> None:
+            async with sem:
+                try:
+                    chats.append(await _chat_session(client, user_id, QUESTIONS[i % len(QUESTIONS)], args.timeout))
+                except Exception as e:
+                    errors.append(f"chat: {e!r}")
+
+        ingests: List[Dict[str, Any]] = []
+
+        async def one_ingest(i: int, content: bytes) -> None:
+            try:
+                ingests.append(await _ingest(client, user_id, f"bench_{i:03d}.pdf", content, args.timeout))
+            except Exception as e:
+                errors.append(f"ingest: {e!r}")
+
+        tasks = [one_chat(i) for i in range(args.sessions)]
+        if pdf is not None and args.uploads:
+            base = pdf.read_bytes()
+            # Bytes after %%EOF are ignored by PDF readers but change the file hash,
+            # so every upload is ingested instead of being skipped as a duplicate
+            tasks += [one_ingest(i, base + f"\n%bench {i}\n".encode()) for i in range(args.uploads)]
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*tasks)
+        wall = time.perf_counter() - t0
+
+        metrics_text = (await client.get("/metrics")).text if args.save_metrics else None
+
+    ttfts = [c["ttft"] for c in chats if c["ttft"] is not None]
+    e2es = [c["e2e"] for c in chats]
+    done = [j for j in ingests if j["status"] == "done"]
+    pages = sum(j["pages_parsed"] for j in done)
+    ingest_time = max((j["wall_s"] for j in done), default=0.0)
+    result = {
+        "cold_start": {"ttft_s": _round(cold["ttft"]), "e2e_s": _round(cold["e2e"])},
+        "chat": {
+            "sessions": len(chats),
+            "concurrency": args.concurrency,
+            "sessions_per_s": _round(len(chats) / wall if wall else 0.0, 3),
+            "chars_per_s": _round(sum(c["chars"] for c in chats) / wall if wall else 0.0, 1),
+            "ttft_s": _summary(ttfts),
+            "e2e_s": _summary(e2es),
+        },
+        "ingest": {
+            "jobs": len(ingests),
+            "failed": len(ingests) - len(done),
+            "pages": pages,
+            "pages_per_s": _round(pages / ingest_time if ingest_time else 0.0, 2),
+            "job_wall_s": _summary([j["wall_s"] for j in done]),
+        },
+        "wall_s": _round(wall, 3),
+        "errors": errors[:20],
+        "error_count": len(errors),
+    }
+    if metrics_text is not None:
+        result["metrics"] = metrics_text
+    return result
+
+
+# Metrics where a larger value is worse; everything else compared is a throughput
+_LOWER_IS_BETTER = [
+    ("chat", "ttft_s", "p95"),
+    ("chat", "e2e_s", "p95"),
+    ("peak_rss_mb",),
+]
+_HIGHER_IS_BETTER = [
+    ("chat", "sessions_per_s"),
+    ("ingest", "pages_per_s"),
+]
+
+
+def _lookup(data: Dict[str, Any], path) -> Optional[float]:
+    for key in path:
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data if isinstance(data, (int, float)) else None
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Regressions beyond `tolerance` (a fraction) relative to a previous --json result."""
+    problems = []
+    for path in _LOWER_IS_BETTER + _HIGHER_IS_BETTER:
+        now, before = _lookup(current, path), _lookup(baseline, path)
+        if now is None or not before:
+            continue
+        worse = now > before * (1 + tolerance) if path in _LOWER_IS_BETTER else now < before * (1 - tolerance)
+        if worse:
+            problems.append(f"{'.'.join(path)}: {before} -> {now}")
+    return problems
+
+
+def _print_report(result: Dict[str, Any]) -> None:
+    chat, ingest = result["chat"], result["ingest"]
+
+    def ms(summary: Dict[str, Optional[float]]) -> str:
+        return "  ".join(f"{k} {v * 1000:8.1f}ms" if v is not None else f"{k}      n/a" for k, v in summary.items())
+
+    print(f"cold start     ttft {result['cold_start']['ttft_s']}s  e2e {result['cold_start']['e2e_s']}s")
+    print(f"chat           {chat['sessions']} sessions @ {chat['concurrency']} concurrent: "
+          f"{chat['sessions_per_s']} sessions/s, {chat['chars_per_s']} chars/s")
+    print(f"  ttft         {ms(chat['ttft_s'])}")
+    print(f"  end-to-end   {ms(chat['e2e_s'])}")
+    print(f"ingest         {ingest['jobs']} jobs ({ingest['failed']} failed), {ingest['pages']} pages, "
+          f"{ingest['pages_per_s']} pages/s")
+    print(f"  job wall     {ms(ingest['job_wall_s'])}")
+    print(f"peak RSS       {result['peak_rss_mb']} MB (server + {result['child_processes']} worker processes), "
+          f"{result['peak_rss_parent_mb']} MB server alone")
+    print(f"wall           {result['wall_s']}s, {result['error_count']} errors")
+    for e in result["errors"]:
+        print(f"  {e}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Offline load test with a stub LLM")
+    parser.add_argument("--sessions", type=int, default=50, help="chat sessions (send + stream)")
+    parser.add_argument("--concurrency", type=int, default=8, help="chat sessions in flight")
+    parser.add_argument("--uploads", type=int, default=2, help="PDF ingestions run alongside the chats")
+    parser.add_argument("--pdf", type=Path, help="PDF to upload (default: first PDF in backend/data/uploads)")
+    parser.add_argument("--ttft-ms", type=float, default=300.0, help="stub LLM delay before the first token")
+    parser.add_argument("--token-ms", type=float, default=20.0, help="stub LLM delay between tokens")
+    parser.add_argument("--tokens", type=int, default=200, help="stub LLM tokens per answer")
+    parser.add_argument("--models-dir", type=Path, default=DEFAULT_MODELS_DIR, help="embedding model cache (read-only use)")
+    parser.add_argument("--data-dir", type=Path, help="scratch DATA_DIR (default: a temporary directory, removed afterwards)")
+    parser.add_argument("--timeout", type=float, default=300.0, help="per-request / per-job timeout, seconds")
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    parser.add_argument("--json", type=Path, help="write the results here")
+    parser.add_argument("--save-metrics", action="store_true", help="include the server's /metrics text in --json")
+    parser.add_argument("--compare", type=Path, help="previous --json result; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression for --compare (fraction)")
+    args = parser.parse_args()
+
+    if not _has_onnx_model(args.models_dir):
+        print(f"no ONNX embedding model under {args.models_dir}; the bench runs with HF_HUB_OFFLINE=1 and "
+              "cannot download it. Fetch it once (see the module docstring) or pass --models-dir.")
+        return 2
+
+    pdf = args.pdf
+    if pdf is None and args.uploads:
+        pdf = next(iter(sorted(DEFAULT_PDF_DIR.glob("*.pdf"))), None)
+        if pdf is None:
+            print("no PDF found for the ingestion load; pass --pdf or --uploads 0")
+            return 2
+
+    scratch = args.data_dir or Path(tempfile.mkdtemp(prefix="riverai-bench-"))
+    (scratch / "uploads").mkdir(parents=True, exist_ok=True)
+    env = {
+        **os.environ,
+        "DATA_DIR": scratch.as_posix(),
+        "MODELS_DIR": args.models_dir.resolve().as_posix(),
+        "DEEPSEEK_API_KEY": "bench",
+        "HF_HUB_OFFLINE": "1",
+        "METRICS_ENABLED": "1",
+        "PYTHONUNBUFFERED": "1",
+    }
+
+    servers: List[Server] = []
+    try:
+        stub = Server(
+            "stub_llm",
+            ["-m", "backend.bench.stub_llm", "--port", "{port}", "--ttft-ms", str(args.ttft_ms),
+             "--token-ms", str(args.token_ms), "--tokens", str(args.tokens)],
+            env, scratch, "/v1/models",
+        )
+        servers.append(stub)
+        stub.wait_ready(args.startup_timeout)
+
+        env["DEEPSEEK_BASE_URL"] = stub.url + "/v1"
+        app = Server(
+            "backend",
+            ["-m", "uvicorn", "backend.main:app", "--host", "127.0.0.1", "--port", "{port}",
+             "--log-level", "warning", "--no-access-log"],
+            env, scratch, "/metrics",
+        )
+        servers.append(app)
+        app.wait_ready(args.startup_timeout)
+
+        result = asyncio.run(_run_load(app.url, args, pdf))
+        # Before stopping: the pool workers are children of the live server
+        result.update(_process_tree_rss(app.proc.pid))
+        result["config"] = {k: getattr(args, k) for k in ("sessions", "concurrency", "uploads", "ttft_ms", "token_ms", "tokens")}
+    except Exception as e:
+        print(f"benchmark failed: {e}")
+        for server in servers:
+            server.stop()
+            print(f"--- {server.name} log (tail) ---\n{server.tail()}")
+        return 1
+    finally:
+        for server in reversed(servers):
+            server.stop()
+        if args.data_dir is None:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    _print_report(result)
+    if args.json:
+        args.json.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    if args.compare:
+        problems = compare(result, json.loads(args.compare.read_text(encoding="utf-8")), args.tolerance)
+        for p in problems:
+            print(f"REGRESSION {p}")
+        if problems:
+            return 1
+    return 1 if result["error_count"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
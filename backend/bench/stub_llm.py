@@ -0,0 +1,111 @@
+"""OpenAI-compatible stub LLM for offline benchmarks.
+
+Serves /v1/chat/completions (streaming and not) and /v1/models, answering every
+request with the same canned text after a configurable first-token delay and
+per-token latency. Point DEEPSEEK_BASE_URL at http://<host>:<port>/v1.
+
+    python -m backend.bench.stub_llm --port 18080 --ttft-ms 300 --token-ms 20 --tokens 200
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from typing import Any, Dict, List
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+# Cycled to build the answer; mixed Chinese/ASCII like real replies
+_WORDS = ["河道", "岸线", "管控", "范围", "水域", " the", " river", " bank", "，", "。", "保护", "利用"]
+
+
+def make_app(ttft_ms: float = 300.0, token_ms: float = 20.0, tokens: int = 200) -> FastAPI:
+    app = FastAPI(title="stub-llm")
+    app.state.stats = {"requests": 0, "streams": 0, "active": 0}
+
+    def answer() -> List[str]:
+        return [_WORDS[i % len(_WORDS)] for i in range(tokens)]
+
+    def chunk(cid: str, model: str, delta: Dict[str, Any], finish: str | None = None) -> str:
+        body = {
+            "id": cid,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+        }
+        return f"data: {json.dumps(body, ensure_ascii=False)}\n\n"
+
+    def usage(prompt: Any) -> Dict[str, int]:
+        prompt_tokens = len(json.dumps(prompt, ensure_ascii=False)) // 4
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": tokens, "total_tokens": prompt_tokens + tokens}
+
+    @app.get("/v1/models")
+    def models():
+        return {"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "bench"}]}
+
+    @app.get("/stats")
+    def stats():
+        return app.state.stats
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "stub")
+        cid = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        app.state.stats["requests"] += 1
+
+        if not body.get("stream"):
+            await asyncio.sleep((ttft_ms + token_ms * tokens) / 1000)
+            return JSONResponse({
+                "id": cid,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(answer())}, "finish_reason": "stop"}],
+                "usage": usage(body.get("messages")),
+            })
+
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+        async def events():
+            app.state.stats["streams"] += 1
+            app.state.stats["active"] += 1
+            try:
+                await asyncio.sleep(ttft_ms / 1000)
+                yield chunk(cid, model, {"role": "assistant", "content": ""})
+                for i, token in enumerate(answer()):
+                    if i:
+                        await asyncio.sleep(token_ms / 1000)
+                    yield chunk(cid, model, {"content": token})
+                yield chunk(cid, model, {}, "stop")
+                if include_usage:
+                    tail = {"id": cid, "object": "chat.completion.chunk", "created": int(time.time()),
+                            "model": model, "choices": [], "usage": usage(body.get("messages"))}
+                    yield f"data: {json.dumps(tail)}\n\n"
+                yield "data: [DONE]\n\n"
+            finally:
+                app.state.stats["active"] -= 1
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--ttft-ms", type=float, default=300.0, help="delay before the first token")
+    parser.add_argument("--token-ms", type=float, default=20.0, help="delay between tokens")
+    parser.add_argument("--tokens", type=int, default=200, help="tokens per answer")
+    args = parser.parse_args()
+    app = make_app(args.ttft_ms, args.token_ms, args.tokens)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
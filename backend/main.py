@@ -1,4 +1,5 @@
 import os
+import threading
 from contextlib import asynccontextmanager
 import uvicorn
 from fastapi import FastAPI
@@ -7,12 +8,24 @@ from fastapi.middleware.cors import CORSMiddleware
 from sqlmodel import select
 from passlib.context import CryptContext
 
-from backend.app.core.db import init_db, get_session
-from backend.app.core.config import UPLOADS_DIR, LANCEDB_DIR, DATA_DIR
+from backend.app.core.db import init_db, get_session, close_db, async_engine
+from backend.app.core.config import UPLOADS_DIR, LANCEDB_DIR, DATA_DIR, METRICS_ENABLED
+from backend.app.core.metrics import MetricsMiddleware
 from backend.app.db.models import User
 from backend.app.api.auth import router as auth_router
 from backend.app.api.chat import router as chat_router
 from backend.app.api.upload import router as upload_router
+from backend.app.api.kb import router as kb_router
+from backend.app.api.water import router as water_router
+from backend.app.api.metrics import router as metrics_router
+from backend.app.agents.ingest_jobs import shutdown_ingest_workers
+from backend.app.agents.prefetch import shutdown_prefetch
+from backend.app.tools.water import shutdown_water_pool
+from backend.app.db.writer import shutdown_writer
+from backend.app.db.retention import start_retention, stop_retention
+from backend.app.agents.memory import history
+from backend.app.agents.registry import get_kb
+from backend.app.agents.kb_index import maintain_kb_quietly
 
 # Crypto context
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -35,9 +48,23 @@ async def lifespan(app: FastAPI):
             )
             session.add(admin_user)
             session.commit()
+
+    # Make sure the KB has its ANN index and is compacted, without delaying startup
+    threading.Thread(target=lambda: maintain_kb_quietly(get_kb()), name="kb-maintenance", daemon=True).start()
+    # Periodic purge of expired conversations / session state (if retention is configured)
+    start_retention()
     
     yield
-    # Shutdown: (Cleanup if needed)
+    # Shutdown: stop background workers and flush queued message writes
+    stop_retention()
+    shutdown_ingest_workers()
+    shutdown_prefetch()
+    shutdown_water_pool()
+    shutdown_writer()
+    history.shutdown()
+    close_db()
+    if async_engine is not None:
+        await async_engine.dispose()
 
 app = FastAPI(title="RiverAI Backend", lifespan=lifespan)
 
@@ -48,7 +75,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing"],  # pagination cursor, per-stage timings
 )
+if METRICS_ENABLED:
+    # Request latency per route for /metrics; Server-Timing headers with METRICS_TIMING_HEADERS=1
+    app.add_middleware(MetricsMiddleware)
 
 # Static Files
 app.mount("/files", StaticFiles(directory=DATA_DIR), name="files")
@@ -57,6 +88,10 @@ app.mount("/files", StaticFiles(directory=DATA_DIR), name="files")
 app.include_router(auth_router)
 app.include_router(chat_router)
 app.include_router(upload_router)
+app.include_router(kb_router)
+app.include_router(water_router)
+if METRICS_ENABLED:
+    app.include_router(metrics_router)
 
 if __name__ == "__main__":
     uvicorn.run("backend.main:app", host="0.0.0.0", port=8006, reload=True)
@@ -49,11 +49,15 @@ const MessageBubble = ({ role, content, metadata }: { role: string, content: str
 
 export default function ChatArea() {
   const { user } = useAuthStore();
-  const { messages, addMessage, setMessages, currentConversationId, setCurrentConversationId, setConversations, conversations, updateConversation } = useChatStore();
+  const { messages, addMessage, setMessages, prependMessages, currentConversationId, setCurrentConversationId, setConversations, conversations, updateConversation } = useChatStore();
   const [input, setInput] = useState("");
   const [isLoading, setIsLoading] = useState(false);
   const [mode, setMode] = useState<"chat" | "agent">("chat");
   const messagesEndRef = useRef<HTMLDivElement>(null);
+  // Cursor of the next older page of the open conversation
+  const [olderCursor, setOlderCursor] = useState<string | null>(null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
+  const skipScrollRef = useRef(false);
   const fileInputRef = useRef<HTMLInputElement>(null);
 
   // Edit title state
@@ -87,14 +91,23 @@ export default function ChatArea() {
   };
 
   useEffect(() => {
+    // Older pages are prepended above; keep the reader where they are
+    if (skipScrollRef.current) {
+      skipScrollRef.current = false;
+      return;
+    }
     scrollToBottom();
   }, [messages]);
 
   useEffect(() => {
+    setOlderCursor(null);
     if (currentConversationId) {
       setIsLoading(true);
       api.getMessages(currentConversationId)
-        .then(setMessages)
+        .then(page => {
+          setMessages(page.items);
+          setOlderCursor(page.nextCursor);
+        })
         .catch(console.error)
         .finally(() => setIsLoading(false));
     } else {
@@ -102,6 +115,21 @@ export default function ChatArea() {
     }
   }, [currentConversationId, setMessages]);
 
+  const loadOlderMessages = async () => {
+    if (!currentConversationId || !olderCursor || loadingOlder) return;
+    setLoadingOlder(true);
+    try {
+      const page = await api.getMessages(currentConversationId, olderCursor);
+      skipScrollRef.current = true;
+      prependMessages(page.items);
+      setOlderCursor(page.nextCursor);
+    } catch (error) {
+      console.error("Failed to load older messages", error);
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
   const handleSend = async () => {
     if (!input.trim() || !user || isLoading) return;
 
@@ -129,7 +157,7 @@ export default function ChatArea() {
       if (!currentConversationId) {
         setCurrentConversationId(res.conversation_id);
         // Refresh conversation list so it appears in sidebar
-        api.getConversations(user.id).then(setConversations);
+        api.getConversations(user.id).then(p => setConversations(p.items, p.nextCursor));
       }
 
       // 2. Start Streaming
@@ -180,7 +208,7 @@ export default function ChatArea() {
             const text = data.content || "";
             aiContent += text;
             
-            // Check for references
+            // References arrive once per reply, in their own "references" event
             if (data.references) {
                  useChatStore.setState(state => {
                     const newMsgs = [...state.messages];
@@ -245,7 +273,7 @@ export default function ChatArea() {
       // Determine file type
       if (file.type === 'application/pdf') {
           await api.uploadPdf(user.id, file);
-          alert("PDF Uploaded and Ingested Successfully!");
+          alert("PDF Uploaded! Ingestion is running in the background.");
       } else if (file.type.startsWith('image/')) {
           // Upload image to backend
           const res = await api.uploadImage(user.id, file);
@@ -320,6 +348,18 @@ export default function ChatArea() {
               </div>
             )}
             
+            {olderCursor && (
+              <div className="flex justify-center">
+                <button
+                  onClick={loadOlderMessages}
+                  disabled={loadingOlder}
+                  className="text-xs px-3 py-1 rounded-full bg-slate-800 text-slate-400 hover:text-cyan-400 border border-slate-700 transition-colors disabled:opacity-50"
+                >
+                  {loadingOlder ? "加载中..." : "加载更早的消息"}
+                </button>
+              </div>
+            )}
+
             {messages.map((m, i) => (
               <MessageBubble key={i} {...m} />
             ))}
@@ -415,7 +455,7 @@ export default function ChatArea() {
                                 </span>
                             </div>
                             <div className="text-slate-400 text-xs line-clamp-4 leading-relaxed bg-black/20 p-2 rounded">
-                                {ref.content || "无内容预览"}
+                                {ref.snippet || ref.content || "无内容预览"}
                             </div>
                             {ref.page && (
                                 <div className="mt-2 text-xs text-slate-500 text-right">
@@ -1,4 +1,4 @@
-import { useEffect } from 'react';
+import { useEffect, useState } from 'react';
 import { MessageSquare, Plus, Settings, LogOut, User as UserIcon, Trash2, Bot, MessageCircle } from 'lucide-react';
 import { motion, AnimatePresence } from 'framer-motion';
 import { useAuthStore, useChatStore, useUIStore } from '@/lib/store';
@@ -7,15 +7,29 @@ import { cn } from '@/lib/utils';
 
 export default function Sidebar() {
   const { user, logout } = useAuthStore();
-  const { conversations, setConversations, currentConversationId, setCurrentConversationId, deleteConversation } = useChatStore();
+  const { conversations, conversationsCursor, setConversations, appendConversations, currentConversationId, setCurrentConversationId, deleteConversation } = useChatStore();
   const { sidebarOpen, toggleSettings } = useUIStore();
+  const [loadingMore, setLoadingMore] = useState(false);
 
   useEffect(() => {
     if (user) {
-      api.getConversations(user.id).then(setConversations).catch(console.error);
+      api.getConversations(user.id).then(p => setConversations(p.items, p.nextCursor)).catch(console.error);
     }
   }, [user, setConversations]);
 
+  const handleLoadMore = async () => {
+    if (!user || !conversationsCursor || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const page = await api.getConversations(user.id, conversationsCursor);
+      appendConversations(page.items, page.nextCursor);
+    } catch (error) {
+      console.error("Failed to load conversations", error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleNewChat = () => {
     setCurrentConversationId(null);
   };
@@ -84,6 +98,16 @@ export default function Sidebar() {
             </button>
           </div>
         ))}
+
+        {conversationsCursor && (
+          <button
+            onClick={handleLoadMore}
+            disabled={loadingMore}
+            className="w-full py-2 text-xs text-slate-500 hover:text-cyan-400 transition-colors disabled:opacity-50"
+          >
+            {loadingMore ? "加载中..." : "加载更多"}
+          </button>
+        )}
       </div>
 
       {/* User Profile */}
@@ -1,8 +1,8 @@
-import { AuthResponse, User } from "@/types";
+import { AuthResponse, Conversation, Message, Page, User } from "@/types";
 
 const API_BASE_URL = "http://localhost:8006";
 
-async function request<T>(endpoint: string, options: RequestInit = {}): Promise<T> {
+async function send(endpoint: string, options: RequestInit = {}): Promise<Response> {
   const token = localStorage.getItem("token");
   const headers: HeadersInit = {
     // "Content-Type": "application/json",  <-- Removed default here
@@ -29,9 +29,20 @@ async function request<T>(endpoint: string, options: RequestInit = {}): Promise<
     throw new Error(errorMessage);
   }
 
+  return response;
+}
+
+async function request<T>(endpoint: string, options: RequestInit = {}): Promise<T> {
+  const response = await send(endpoint, options);
   return response.json();
 }
 
+// Paginated listings return a plain list; the next page's cursor comes in X-Next-Cursor
+async function requestPage<T>(endpoint: string): Promise<Page<T>> {
+  const response = await send(endpoint);
+  return { items: await response.json(), nextCursor: response.headers.get("X-Next-Cursor") };
+}
+
 export const api = {
   login: (data: any) => request<AuthResponse>("/auth/login", {
     method: "POST",
@@ -57,14 +68,47 @@ export const api = {
     return response.json();
   },
 
-  getConversations: (userId: number) => request<any[]>(`/chat/conversations?user_id=${userId}`),
+  uploadImage: async (userId: number, file: File) => {
+    const formData = new FormData();
+    formData.append("file", file);
+    const token = localStorage.getItem("token");
+    const response = await fetch(`${API_BASE_URL}/upload/image?user_id=${userId}`, {
+      method: "POST",
+      headers: token ? { Authorization: `Bearer ${token}` } : {},
+      body: formData,
+    });
+    if (!response.ok) throw new Error("Upload failed");
+    return response.json() as Promise<{ filename: string; file_path: string }>;
+  },
+
+  getIngestJob: (jobId: string) => request<any>(`/upload/jobs/${jobId}`),
+
+  // Removes the file; the returned ingest job drops its vectors from the knowledge base
+  deletePdf: (userId: number, filename: string) =>
+    request<{ filename: string; job_id: string; status: string }>(
+      `/upload/pdf/${encodeURIComponent(filename)}?user_id=${userId}`,
+      { method: "DELETE" }
+    ),
+
+  // Listings are paginated; pass the previous page's nextCursor to fetch older items
+  getConversations: (userId: number, cursor?: string | null) =>
+    requestPage<Conversation>(`/chat/conversations?user_id=${userId}${cursor ? `&cursor=${encodeURIComponent(cursor)}` : ""}`),
   
-  getMessages: (conversationId: number) => request<any[]>(`/chat/conversations/${conversationId}/messages`),
+  getMessages: (conversationId: number, cursor?: string | null) =>
+    requestPage<Message>(`/chat/conversations/${conversationId}/messages${cursor ? `?cursor=${encodeURIComponent(cursor)}` : ""}`),
 
   deleteConversation: (id: number) => request<{ ok: boolean }>(`/chat/conversations/${id}`, {
     method: "DELETE"
   }),
 
+  searchMessages: (userId: number, q: string, limit = 20) =>
+    request<any[]>(`/chat/search?user_id=${userId}&q=${encodeURIComponent(q)}&limit=${limit}`),
+
+  deleteConversations: (userId: number, ids: number[]) => request<{ ok: boolean; deleted: number }>("/chat/conversations/delete", {
+    method: "POST",
+    body: JSON.stringify({ user_id: userId, ids })
+  }),
+
   updateConversationTitle: (id: number, title: string) => request<{ id: number; title: string }>(`/chat/conversations/${id}`, {
     method: "PATCH",
     body: JSON.stringify({ title })
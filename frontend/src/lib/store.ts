@@ -35,23 +35,32 @@ if (typeof window !== 'undefined') {
 
 interface ChatState {
   conversations: Conversation[];
+  conversationsCursor: string | null; // next (older) page of the sidebar list
   currentConversationId: number | null;
   messages: Message[];
-  setConversations: (conversations: Conversation[]) => void;
+  setConversations: (conversations: Conversation[], cursor?: string | null) => void;
+  appendConversations: (conversations: Conversation[], cursor: string | null) => void;
   setCurrentConversationId: (id: number | null) => void;
   addMessage: (message: Message) => void;
   setMessages: (messages: Message[]) => void;
+  prependMessages: (messages: Message[]) => void;
   deleteConversation: (id: number) => void;
 }
 
 export const useChatStore = create<ChatState>((set) => ({
   conversations: [],
+  conversationsCursor: null,
   currentConversationId: null,
   messages: [],
-  setConversations: (conversations) => set({ conversations }),
+  setConversations: (conversations, cursor = null) => set({ conversations, conversationsCursor: cursor }),
+  appendConversations: (conversations, cursor) => set((state) => ({
+    conversations: [...state.conversations, ...conversations.filter(c => !state.conversations.some(e => e.id === c.id))],
+    conversationsCursor: cursor
+  })),
   setCurrentConversationId: (id) => set({ currentConversationId: id, messages: [] }), // Clear messages on switch, need to load
   addMessage: (message) => set((state) => ({ messages: [...state.messages, message] })),
   setMessages: (messages) => set({ messages }),
+  prependMessages: (messages) => set((state) => ({ messages: [...messages, ...state.messages] })),
   deleteConversation: (id) => set((state) => ({
     conversations: state.conversations.filter(c => c.id !== id),
     currentConversationId: state.currentConversationId === id ? null : state.currentConversationId,
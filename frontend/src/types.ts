@@ -23,6 +23,12 @@ export interface Message {
   created_at: string;
 }
 
+// One page of a keyset-paginated listing; nextCursor is null on the last page
+export interface Page<T> {
+  items: T[];
+  nextCursor: string | null;
+}
+
 export interface AuthResponse {
   access_token: string;
   token_type: string;